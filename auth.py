@@ -2,25 +2,34 @@ from dotenv import load_dotenv
 import requests
 import base64
 import os
+import re
+import threading
+import time
 import logging
 
+from ingestion.rate_limiter import TokenBucket
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
 
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-def get_spotify_access_token(num):
-    try:
-        spotify_client_id = os.getenv(f"SPOTIFY_CLIENT_ID_{num}")
-        spotify_client_secret = os.getenv(f"SPOTIFY_CLIENT_SECRET_{num}")
+AUTH_URL = "https://accounts.spotify.com/api/token"
+# Tokens are refreshed this many seconds before Spotify says they expire.
+TOKEN_REFRESH_MARGIN = 60
+
+_token_pool = None
+_token_pool_lock = threading.Lock()
 
+
+def request_spotify_access_token(spotify_client_id, spotify_client_secret):
+    """Requests a client-credentials token, returns the token and its lifetime in seconds"""
+    try:
         auth_string = f"{spotify_client_id}:{spotify_client_secret}"
         auth_bytes = auth_string.encode("utf-8")
         auth_base64 = base64.b64encode(auth_bytes).decode("utf-8")
 
-        auth_url = "https://accounts.spotify.com/api/token"
-
         headers = {
             "Authorization": f"Basic {auth_base64}",
             "Content-Type": "application/x-www-form-urlencoded"
@@ -30,9 +39,112 @@ def get_spotify_access_token(num):
             "grant_type": "client_credentials"
         }
 
-        response = requests.post(auth_url, headers=headers, data=data, timeout=10)
+        response = requests.post(AUTH_URL, headers=headers, data=data, timeout=10)
         response.raise_for_status()
-        return response.json()["access_token"]
+        body = response.json()
+        return body["access_token"], body.get("expires_in", 3600)
+    except Exception as e:
+        logger.error(f"Error getting Spotify access token: {e}")
+        raise
+
+
+class SpotifyCredential:
+    """One SPOTIFY_CLIENT_ID_n/SECRET_n pair with its cached token and its own rate limiter"""
+
+    def __init__(self, num, client_id, client_secret):
+        self.num = num
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.limiter = TokenBucket()
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get_token(self):
+        """Returns the cached token, refreshing it shortly before it expires"""
+        with self._lock:
+            if self._token is None or time.monotonic() >= self._expires_at - TOKEN_REFRESH_MARGIN:
+                token, expires_in = request_spotify_access_token(
+                    self.client_id, self.client_secret
+                )
+                self._token = token
+                self._expires_at = time.monotonic() + expires_in
+                logger.info(f"Refreshed Spotify access token for credential {self.num}")
+            return self._token
+
+    def invalidate(self):
+        """Drops the cached token so the next request fetches a new one"""
+        with self._lock:
+            self._token = None
+
+
+class SpotifyTokenPool:
+    """Every configured Spotify credential, handed out least-throttled first"""
+
+    def __init__(self, credentials):
+        if not credentials:
+            raise ValueError("No Spotify credentials configured")
+        self.credentials = credentials
+
+    @classmethod
+    def from_env(cls):
+        """Loads every SPOTIFY_CLIENT_ID_n/SPOTIFY_CLIENT_SECRET_n pair from the environment"""
+        credentials = []
+        for key in sorted(os.environ):
+            match = re.fullmatch(r"SPOTIFY_CLIENT_ID_(\d+)", key)
+            if not match:
+                continue
+            num = int(match.group(1))
+            client_secret = os.getenv(f"SPOTIFY_CLIENT_SECRET_{num}")
+            if not client_secret:
+                logger.warning(f"SPOTIFY_CLIENT_ID_{num} has no matching secret, skipping it.")
+                continue
+            credentials.append(SpotifyCredential(num, os.environ[key], client_secret))
+        credentials.sort(key=lambda credential: credential.num)
+        logger.info(f"Loaded {len(credentials)} Spotify credentials")
+        return cls(credentials)
+
+    def credential(self, num):
+        """Returns the credential with the given number"""
+        for credential in self.credentials:
+            if credential.num == num:
+                return credential
+        raise ValueError(f"Spotify credential {num} is not configured")
+
+    def subset(self, nums):
+        """Returns a pool restricted to the given credential numbers, sharing their state"""
+        return SpotifyTokenPool([self.credential(num) for num in nums])
+
+    def acquire(self):
+        """Picks the credential that can send soonest and waits for its rate limiter.
+
+        A credential blocked by Retry-After reports a long wait, so it drops out of
+        rotation until the block expires unless every credential is blocked.
+        """
+        credential = min(
+            self.credentials,
+            key=lambda credential: (
+                credential.limiter.wait_time(),
+                credential.limiter.throttle_count,
+            ),
+        )
+        credential.limiter.acquire()
+        return credential
+
+
+def get_token_pool():
+    """Returns the process wide token pool, loading it from the environment on first use"""
+    global _token_pool
+    with _token_pool_lock:
+        if _token_pool is None:
+            _token_pool = SpotifyTokenPool.from_env()
+        return _token_pool
+
+
+def get_spotify_access_token(num):
+    """Returns a cached access token for credential `num`"""
+    try:
+        return get_token_pool().credential(num).get_token()
     except Exception as e:
         logger.error(f"Error getting Spotify access token: {e}")
-        raise
\ No newline at end of file
+        raise
@@ -0,0 +1,142 @@
+import argparse
+import random
+import re
+import string
+import time
+import unicodedata
+
+from ingestion.normalizer import DISTINCT_VERSIONS, SAME_RECORDING, normalize_song_name
+
+"""Micro-benchmark for ingestion.normalizer: checks that the normalizer gives the same output as
+the reference implementation and reports titles/second for both."""
+
+BASE_TITLES = [
+    "Supersonic",
+    "Wonderwall",
+    "Champagne Supernova",
+    "Don't Look Back In Anger",
+    "Señorita",
+    "Café del Mar",
+    "Ｆｕｌｌｗｉｄｔｈ Song",
+    "Hey Jude",
+    "99 Problems",
+    "Lose Yourself",
+    "Blinding Lights",
+    "Hotline Bling",
+    "Perfect",
+    "",
+    "1999",
+]
+SUFFIXES = [
+    "",
+    " - Remastered",
+    " - Remastered 2011",
+    " (Live at Wembley)",
+    " (feat. Drake)",
+    " [ft. Rihanna]",
+    " - feat. Future",
+    " (Deluxe Edition)",
+    " - Radio Edit",
+    " (2009)",
+    " - Acoustic Version",
+    " (Featuring Jay-Z) - Remix",
+    " -(feat. A)ft. B",
+    "  (Mono)\t",
+    " – Single Version",
+]
+
+
+def reference_normalize_song_name(title: str) -> str:
+    """The normalizer as it was before it was precompiled and memoized, kept as the reference."""
+    if not title:
+        return ""
+    
+    original_title = title
+    
+    title = unicodedata.normalize("NFKD", title).casefold()
+    
+    feat_patterns = [
+        r'\s*[\(\[\{]\s*feat\.?[^\)\]\}]*[\)\]\}]',  # (feat. X)
+        r'\s*[\(\[\{]\s*ft\.?[^\)\]\}]*[\)\]\}]',     # (ft. X)
+        r'\s*[\(\[\{]\s*featuring[^\)\]\}]*[\)\]\}]', # (featuring X)
+        r'\s*-\s*feat\.?.*$',                          # - feat. X
+        r'\s*-\s*ft\.?.*$',                            # - ft. X
+        r'\s*-\s*featuring.*$',                        # - featuring X
+    ]
+    
+    for pattern in feat_patterns:
+        title = re.sub(pattern, '', title, flags=re.IGNORECASE)
+
+    title = re.sub(r'\s*[\(\[\{]\s*\d{4}\s*[\)\]\}]', '', title)
+    # Remove standalone 4-digit years starting with 10..20 (e.g., 1995, 2011) anywhere in the title
+    title = re.sub(r'\b(1[0-9]{3}|20[0-9]{2})\b', '', title)
+    
+    title = title.translate(str.maketrans('', '', string.punctuation))
+    
+    title = re.sub(r'\s+', ' ', title).strip()
+    
+    words = title.split()
+    
+    if not words:
+        return original_title.lower()
+    
+    filtered_words = []
+    for word in words:
+        if word in DISTINCT_VERSIONS:
+            filtered_words.append(word)
+        elif word not in SAME_RECORDING:
+            filtered_words.append(word)
+    
+    result = ' '.join(filtered_words).strip()
+    
+    return result if result else original_title.lower()
+
+
+def make_titles(count, seed=0):
+    """Builds count titles from the base titles and suffixes, with some random noise"""
+    rng = random.Random(seed)
+    titles = []
+    for i in range(count):
+        title = rng.choice(BASE_TITLES) + rng.choice(SUFFIXES)
+        if i % 3 == 0:
+            title += " " + "".join(rng.choice(string.ascii_letters + string.punctuation) for _ in range(6))
+        titles.append(title)
+    return titles
+
+
+def titles_per_second(normalize, titles):
+    start = time.perf_counter()
+    for title in titles:
+        normalize(title)
+    return len(titles) / (time.perf_counter() - start)
+
+
+def run_benchmark(count):
+    titles = make_titles(count)
+
+    mismatches = [
+        title
+        for title in titles
+        if normalize_song_name(title) != reference_normalize_song_name(title)
+    ]
+    if mismatches:
+        raise AssertionError(f"{len(mismatches)} titles differ from the reference, e.g. {mismatches[:5]}")
+
+    reference = titles_per_second(reference_normalize_song_name, titles)
+    normalize_song_name.cache_clear()
+    uncached = titles_per_second(normalize_song_name.__wrapped__, titles)
+    normalize_song_name.cache_clear()
+    cached = titles_per_second(normalize_song_name, titles)
+
+    print(f"{count} titles, {len(set(titles))} unique, all identical to the reference")
+    print(f"reference:            {reference:>12,.0f} titles/s")
+    print(f"precompiled:          {uncached:>12,.0f} titles/s ({uncached / reference:.1f}x)")
+    print(f"precompiled + memo:   {cached:>12,.0f} titles/s ({cached / reference:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=200_000)
+    args = parser.parse_args()
+
+    run_benchmark(args.count)
@@ -0,0 +1,156 @@
+import io
+import logging
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pcsv
+import pyarrow.parquet as pq
+from psycopg2 import sql
+
+from db.db import connection
+
+logger = logging.getLogger(__name__)
+
+COPY_BATCH_SIZE = 100_000
+STAGING_ROW_COLUMN = "staging_row"
+
+
+def _list_to_pg_array(array):
+    """Renders a list<string> arrow array as postgres array literals, e.g. {"a","b"}"""
+    values = array.values
+    values = pc.replace_substring(values, "\\", "\\\\")
+    values = pc.replace_substring(values, '"', '\\"')
+    values = pc.binary_join_element_wise('"', values, '"', "")
+    values = pc.fill_null(values, "NULL")
+    # The offsets index into the full values buffer, so this also holds for sliced arrays.
+    quoted = pa.ListArray.from_arrays(array.offsets, values)
+    literals = pc.binary_join_element_wise("{", pc.binary_join(quoted, ","), "}", "")
+    return pc.if_else(array.is_null(), pa.scalar(None, pa.string()), literals)
+
+
+def _batch_to_csv(batch):
+    """Serializes a record batch as headerless CSV that COPY ... (FORMAT csv) accepts"""
+    columns = []
+    for column in batch.columns:
+        if pa.types.is_dictionary(column.type):
+            column = column.dictionary_decode()
+        if pa.types.is_list(column.type) or pa.types.is_large_list(column.type):
+            column = _list_to_pg_array(column)
+        columns.append(column)
+    buffer = io.BytesIO()
+    pcsv.write_csv(
+        pa.RecordBatch.from_arrays(columns, names=batch.schema.names),
+        buffer,
+        pcsv.WriteOptions(include_header=False),
+    )
+    return buffer.getvalue()
+
+
+class ArrowCsvStream(io.RawIOBase):
+    """File-like object that renders arrow record batches as CSV lazily, as COPY reads it"""
+
+    def __init__(self, batches):
+        self._batches = iter(batches)
+        self._buffer = bytearray()
+        self.rows = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            batch = next(self._batches, None)
+            if batch is None:
+                break
+            self.rows += batch.num_rows
+            self._buffer += _batch_to_csv(batch)
+        if size < 0:
+            size = len(self._buffer)
+        chunk = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return chunk
+
+
+def copy_batches(cur, table, columns, batches):
+    """COPYs arrow record batches into table, returns the number of rows sent"""
+    stream = ArrowCsvStream(batches)
+    query = sql.SQL("COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)").format(
+        table=sql.Identifier(table),
+        columns=sql.SQL(", ").join(map(sql.Identifier, columns)),
+    )
+    cur.copy_expert(query, stream, size=1 << 20)
+    return stream.rows
+
+
+def merge_staging(cur, staging_table, table, columns, conflict_columns):
+    """Upserts the staging rows into table in one statement. Of rows sharing a key, the last one copied wins."""
+    identifiers = sql.SQL(", ").join(map(sql.Identifier, columns))
+    conflict = sql.SQL(", ").join(map(sql.Identifier, conflict_columns))
+    updates = sql.SQL(", ").join(
+        sql.SQL("{column} = EXCLUDED.{column}").format(column=sql.Identifier(column))
+        for column in columns
+        if column not in conflict_columns
+    )
+    query = sql.SQL(
+        """
+        INSERT INTO {table} ({columns})
+        SELECT DISTINCT ON ({conflict}) {columns} FROM {staging}
+        ORDER BY {conflict}, {staging_row} DESC
+        ON CONFLICT ({conflict}) DO UPDATE SET {updates}
+        """
+    ).format(
+        table=sql.Identifier(table),
+        staging=sql.Identifier(staging_table),
+        columns=identifiers,
+        conflict=conflict,
+        updates=updates,
+        staging_row=sql.Identifier(STAGING_ROW_COLUMN),
+    )
+    cur.execute(query)
+    return cur.rowcount
+
+
+def load_parquet(path, table, columns, conflict_columns, filesystem=None, batch_size=COPY_BATCH_SIZE):
+    """Streams a parquet file into table: record batches are COPYed into an unlogged staging
+    table, then merged with a single INSERT ... ON CONFLICT DO UPDATE on conflict_columns (a
+    column name or a list of them), so reruns are idempotent. Returns the number of rows merged."""
+    if isinstance(conflict_columns, str):
+        conflict_columns = [conflict_columns]
+    staging_table = f"{table}_staging"
+    try:
+        start = time.perf_counter()
+        source = filesystem.open(path, "rb") if filesystem else path
+        parquet_file = pq.ParquetFile(source)
+
+        with connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(
+                    "CREATE UNLOGGED TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS)"
+                ).format(staging=sql.Identifier(staging_table), table=sql.Identifier(table))
+            )
+            # Numbers the rows in COPY order, merge_staging keeps the last row of a duplicate key.
+            cur.execute(
+                sql.SQL("ALTER TABLE {staging} ADD COLUMN IF NOT EXISTS {staging_row} bigserial").format(
+                    staging=sql.Identifier(staging_table), staging_row=sql.Identifier(STAGING_ROW_COLUMN)
+                )
+            )
+            # TRUNCATE also locks the staging table, so concurrent loads of one table queue up.
+            cur.execute(sql.SQL("TRUNCATE {staging}").format(staging=sql.Identifier(staging_table)))
+            copied = copy_batches(
+                cur,
+                staging_table,
+                columns,
+                parquet_file.iter_batches(batch_size=batch_size, columns=columns),
+            )
+            merged = merge_staging(cur, staging_table, table, columns, conflict_columns)
+            cur.execute(sql.SQL("TRUNCATE {staging}").format(staging=sql.Identifier(staging_table)))
+
+        elapsed = time.perf_counter() - start
+        logger.info(
+            f"Loaded {path} into {table}: {copied} rows copied, {merged} rows merged in {elapsed:.2f}s ({copied / max(elapsed, 1e-9):,.0f} rows/s)."
+        )
+        return merged
+    except Exception as e:
+        logger.error(f"Error bulk loading {path} into {table}: {e}")
+        raise
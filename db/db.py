@@ -1,4 +1,12 @@
 import psycopg2
+import psycopg2.extensions
+from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool
+from contextlib import contextmanager
+from collections import Counter
+import threading
+import atexit
+import time
 import os
 import logging
 
@@ -7,16 +15,164 @@ logging.basicConfig(
     level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s"
 )
 
+PGPOOL_MIN = int(os.getenv("PGPOOL_MIN", 1))
+PGPOOL_MAX = int(os.getenv("PGPOOL_MAX", 8))
+# Connections idle for longer than this are checked with a SELECT 1 before being handed out.
+PGPOOL_HEALTH_CHECK_SECONDS = float(os.getenv("PGPOOL_HEALTH_CHECK_SECONDS", 30))
+
+_pool = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool raises when exhausted, the semaphore makes callers wait instead.
+_pool_slots = threading.BoundedSemaphore(PGPOOL_MAX)
+_pool_stats = Counter()
+_stats_lock = threading.Lock()
+_in_use = 0
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """A connection that remembers when it was last returned to the pool"""
+
+    last_used = None
+
+
+def _connection_params():
+    return dict(
+        host=os.getenv("PGHOST"),
+        user=os.getenv("PGUSER"),
+        password=os.getenv("PGPASSWORD"),
+        dbname=os.getenv("PGDATABASE"),
+        port=os.getenv("PGPORT"),
+    )
+
 
 def get_connection():
+    """Opens a new, unpooled connection. Prefer connection() for anything that runs more than once."""
     try:
-        return psycopg2.connect(
-            host=os.getenv("PGHOST"),
-            user=os.getenv("PGUSER"),
-            password=os.getenv("PGPASSWORD"),
-            dbname=os.getenv("PGDATABASE"),
-            port=os.getenv("PGPORT"),
-        )
+        return psycopg2.connect(**_connection_params())
     except Exception as e:
         logger.error(f"Error getting connection: {e}")
         raise
+
+
+def get_pool():
+    """Returns the process wide connection pool, creating it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            try:
+                _pool = ThreadedConnectionPool(
+                    PGPOOL_MIN, PGPOOL_MAX, connection_factory=PooledConnection, **_connection_params()
+                )
+                logger.info(f"Opened connection pool with {PGPOOL_MIN} to {PGPOOL_MAX} connections")
+            except Exception as e:
+                logger.error(f"Error creating connection pool: {e}")
+                raise
+        return _pool
+
+
+def check_connection(conn):
+    """Returns True if the connection can still run a query"""
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except Exception:
+        return False
+
+
+def _record(stat):
+    with _stats_lock:
+        _pool_stats[stat] += 1
+
+
+def _checkout(pool):
+    conn = pool.getconn()
+    stale = conn.last_used is not None and time.monotonic() - conn.last_used > PGPOOL_HEALTH_CHECK_SECONDS
+    if conn.closed or (stale and not check_connection(conn)):
+        _record("health_check_failures")
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    return conn
+
+
+@contextmanager
+def connection():
+    """Checks a warm connection out of the pool. Commits when the block succeeds, rolls back
+    when it raises, and always returns the connection to the pool (closing it if broken)."""
+    global _in_use
+    pool = get_pool()
+    _pool_slots.acquire()
+    conn = None
+    broken = False
+    try:
+        conn = _checkout(pool)
+        _record("checkouts")
+        with _stats_lock:
+            _in_use += 1
+        yield conn
+        conn.commit()
+    except Exception:
+        if conn is not None:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+        raise
+    finally:
+        if conn is not None:
+            with _stats_lock:
+                _in_use -= 1
+            conn.last_used = time.monotonic()
+            pool.putconn(conn, close=broken or bool(conn.closed))
+        _pool_slots.release()
+
+
+def pool_stats():
+    """Returns connection pool metrics"""
+    with _stats_lock:
+        stats = dict(_pool_stats)
+        stats["in_use"] = _in_use
+    stats["min_connections"] = PGPOOL_MIN
+    stats["max_connections"] = PGPOOL_MAX
+    return stats
+
+
+@atexit.register
+def close_pool():
+    """Closes every pooled connection"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            logger.info(f"Closing connection pool, stats {pool_stats()}")
+            _pool.closeall()
+            _pool = None
+
+
+def get_missing_ids(table, column, ids):
+    """Returns the subset of ids that are not yet in table.column.
+
+    Only the candidate ids are sent, and the anti-join runs against the column's unique
+    index, so the cost scales with the number of candidates rather than the table size.
+    """
+    if not ids:
+        return set()
+    query = sql.SQL(
+        """
+        SELECT candidate.id
+        FROM unnest(%s::text[]) AS candidate(id)
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {table} existing WHERE existing.{column} = candidate.id
+        )
+        """
+    ).format(table=sql.Identifier(table), column=sql.Identifier(column))
+
+    try:
+        with connection() as conn, conn.cursor() as cursor:
+            cursor.execute(query, (list(set(ids)),))
+            return {row[0] for row in cursor.fetchall()}
+    except Exception as e:
+        logger.error(f"Error getting missing ids from {table}.{column}: {e}")
+        raise
@@ -0,0 +1,37 @@
+CREATE TABLE IF NOT EXISTS songs (
+    id UUID NOT NULL DEFAULT gen_random_uuid(),
+    spotify_song_id TEXT NOT NULL,
+    spotify_album_id TEXT NOT NULL,
+    song TEXT NOT NULL,
+    album TEXT NOT NULL,
+    origination_artist_id TEXT NOT NULL,
+    artists TEXT[] NOT NULL,
+    spotify_artist_ids TEXT[] NOT NULL,
+    release_date_precision TEXT NOT NULL,
+    release_date DATE NOT NULL,
+    duration_ms INT NOT NULL,
+    explicit BOOLEAN NOT NULL,
+    images TEXT[] NOT NULL,
+    isrc TEXT,
+    total_streams BIGINT NOT NULL DEFAULT 0,
+    popularity INT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    -- The key of a partitioned table has to include the partition column.
+    PRIMARY KEY (spotify_song_id)
+) PARTITION BY HASH (spotify_song_id);
+
+CREATE TABLE IF NOT EXISTS songs_p0 PARTITION OF songs FOR VALUES WITH (MODULUS 8, REMAINDER 0);
+CREATE TABLE IF NOT EXISTS songs_p1 PARTITION OF songs FOR VALUES WITH (MODULUS 8, REMAINDER 1);
+CREATE TABLE IF NOT EXISTS songs_p2 PARTITION OF songs FOR VALUES WITH (MODULUS 8, REMAINDER 2);
+CREATE TABLE IF NOT EXISTS songs_p3 PARTITION OF songs FOR VALUES WITH (MODULUS 8, REMAINDER 3);
+CREATE TABLE IF NOT EXISTS songs_p4 PARTITION OF songs FOR VALUES WITH (MODULUS 8, REMAINDER 4);
+CREATE TABLE IF NOT EXISTS songs_p5 PARTITION OF songs FOR VALUES WITH (MODULUS 8, REMAINDER 5);
+CREATE TABLE IF NOT EXISTS songs_p6 PARTITION OF songs FOR VALUES WITH (MODULUS 8, REMAINDER 6);
+CREATE TABLE IF NOT EXISTS songs_p7 PARTITION OF songs FOR VALUES WITH (MODULUS 8, REMAINDER 7);
+
+CREATE INDEX IF NOT EXISTS songs_isrc_idx ON songs (isrc);
+CREATE INDEX IF NOT EXISTS songs_origination_artist_id_idx ON songs (origination_artist_id);
+CREATE INDEX IF NOT EXISTS songs_spotify_album_id_idx ON songs (spotify_album_id);
+CREATE INDEX IF NOT EXISTS songs_release_date_idx ON songs (release_date);
+CREATE INDEX IF NOT EXISTS songs_popularity_idx ON songs (popularity DESC);
+CREATE INDEX IF NOT EXISTS songs_spotify_artist_ids_idx ON songs USING GIN (spotify_artist_ids);
@@ -0,0 +1,25 @@
+CREATE TABLE IF NOT EXISTS song_groups (
+    id UUID NOT NULL DEFAULT gen_random_uuid(),
+    origination_artist_id TEXT NOT NULL,
+    group_key TEXT NOT NULL,
+    song TEXT NOT NULL,
+    canonical_spotify_song_id TEXT NOT NULL,
+    isrc TEXT,
+    variant_spotify_song_ids TEXT[] NOT NULL,
+    variant_count INT NOT NULL,
+    total_streams BIGINT NOT NULL DEFAULT 0,
+    popularity INT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    -- group_key is the normalized title (plus _variantN) and is only unique per artist.
+    PRIMARY KEY (origination_artist_id, group_key)
+) PARTITION BY HASH (origination_artist_id);
+
+CREATE TABLE IF NOT EXISTS song_groups_p0 PARTITION OF song_groups FOR VALUES WITH (MODULUS 4, REMAINDER 0);
+CREATE TABLE IF NOT EXISTS song_groups_p1 PARTITION OF song_groups FOR VALUES WITH (MODULUS 4, REMAINDER 1);
+CREATE TABLE IF NOT EXISTS song_groups_p2 PARTITION OF song_groups FOR VALUES WITH (MODULUS 4, REMAINDER 2);
+CREATE TABLE IF NOT EXISTS song_groups_p3 PARTITION OF song_groups FOR VALUES WITH (MODULUS 4, REMAINDER 3);
+
+CREATE INDEX IF NOT EXISTS song_groups_canonical_spotify_song_id_idx ON song_groups (canonical_spotify_song_id);
+CREATE INDEX IF NOT EXISTS song_groups_isrc_idx ON song_groups (isrc);
+CREATE INDEX IF NOT EXISTS song_groups_total_streams_idx ON song_groups (total_streams DESC);
+CREATE INDEX IF NOT EXISTS song_groups_variant_spotify_song_ids_idx ON song_groups USING GIN (variant_spotify_song_ids);
@@ -23,17 +23,21 @@ def run_script(script_path, flags):
         raise Exception(f"Script {script_path} failed with code {process.returncode}")
 
 @flow(name="ingestion_flow", log_prints=True)
-def ingestion_flow(page_number: int, batch_number: int):
+def ingestion_flow(page_number: int, batch_number: int, fused: bool = False):
     p = str(page_number)
     b = str(batch_number)
 
-    run_script("ingestion.get_artists", ["--page_number", p, "--batch_number", b, "--num", "1"])
+    run_script("ingestion.get_artists", ["--page_number", p, "--batch_number", b])
     run_script("ingestion.get_genres", ["--page_number", p, "--batch_number", b])
-    run_script("ingestion.get_albums", ["--page_number", p, "--batch_number", b, "--num", "1"])
-    run_script("ingestion.get_songs", ["--page_number", p, "--batch_number", b, "--num", "2"])
-    run_script("ingestion.get_isrc_and_pop", ["--page_number", p, "--batch_number", b, "--num", "3"])
-    run_script("ingestion.group_songs", ["--page_number", p, "--batch_number", b])
-    run_script("ingestion.get_streams", ["--page_number", p, "--batch_number", b, "--num", "1"])
+    run_script("ingestion.get_albums", ["--page_number", p, "--batch_number", b])
+    if fused:
+        # Songs, ISRC/popularity, grouping and streams in one process, songs.json is written once.
+        run_script("ingestion.artist_pipeline", ["--page_number", p, "--batch_number", b])
+    else:
+        run_script("ingestion.get_songs", ["--page_number", p, "--batch_number", b])
+        run_script("ingestion.get_isrc_and_pop", ["--page_number", p, "--batch_number", b])
+        run_script("ingestion.group_songs", ["--page_number", p, "--batch_number", b])
+        run_script("ingestion.get_streams", ["--page_number", p, "--batch_number", b])
     run_script("ingestion.create_parquet", ["--page_number", p, "--batch_number", b])
     run_script("ingestion.insert_db", ["--page_number", p, "--batch_number", b])
 
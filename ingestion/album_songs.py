@@ -0,0 +1,94 @@
+import struct
+import logging
+
+from ingestion.codec import encode_json, decode_json
+
+logger = logging.getLogger(__name__)
+
+"""One blob per artist holding the songs of every album and single, {artist}/album_songs.pack, instead of a
+songs.json per album folder. The blob is each album's songs encoded by the raw codec one after the other,
+followed by a {album id: [offset, length]} index, the index's length and a magic, like a parquet footer.
+A single album is read with two ranged reads (the tail with the index, then the album's bytes)."""
+
+ALBUM_SONGS_FILE = "album_songs.pack"
+MAGIC = b"ASP1"
+FOOTER = struct.Struct("<Q4s")
+# Enough for the index of any but the largest discographies, which cost one more ranged read.
+TAIL_BYTES = 64 * 1024
+
+
+def group_songs_by_album(songs):
+    """{album id: songs} in the order the albums first appear"""
+    album_songs = {}
+    for song in songs:
+        album_songs.setdefault(song["spotify_album_id"], []).append(song)
+    return album_songs
+
+
+def encode_album_songs(album_songs):
+    """Builds the container of {album id: songs}"""
+    segments = []
+    index = {}
+    offset = 0
+    for album_id, songs in album_songs.items():
+        segment = encode_json(songs)
+        index[album_id] = [offset, len(segment)]
+        segments.append(segment)
+        offset += len(segment)
+    encoded_index = encode_json(index)
+    segments.append(encoded_index)
+    segments.append(FOOTER.pack(len(encoded_index), MAGIC))
+    return b"".join(segments)
+
+
+def put_album_songs(uploads, artist, bucket_name, album_songs):
+    """Queues an artist's container on an UploadQueue"""
+    uploads.put(
+        bucket_name,
+        f"{artist['full_blob_name']}/{ALBUM_SONGS_FILE}",
+        encode_album_songs(album_songs),
+        content_type="application/octet-stream",
+    )
+
+
+def decode_index(tail, blob_name):
+    """Parses the index at the end of the container, returns (index, size of index and footer).
+    The index is None when tail is too short to hold it."""
+    index_length, magic = FOOTER.unpack(tail[-FOOTER.size :])
+    if magic != MAGIC:
+        raise ValueError(f"{blob_name} is not an album songs container")
+    needed = index_length + FOOTER.size
+    if len(tail) < needed:
+        return None, needed
+    return decode_json(tail[-needed : -FOOTER.size]), needed
+
+
+def decode_album_songs(data, blob_name=ALBUM_SONGS_FILE):
+    """Parses a whole container into {album id: songs}"""
+    index, _ = decode_index(data, blob_name)
+    return {
+        album_id: decode_json(data[offset : offset + length])
+        for album_id, (offset, length) in index.items()
+    }
+
+
+def read_album_songs_index(storage, bucket_name, blob_name):
+    """Reads only the container's index"""
+    tail = storage.read_range(bucket_name, blob_name, -TAIL_BYTES)
+    index, needed = decode_index(tail, blob_name)
+    if index is None:
+        index, _ = decode_index(storage.read_range(bucket_name, blob_name, -needed), blob_name)
+    return index
+
+
+def read_album_songs(storage, bucket_name, blob_name, album_id):
+    """Reads one album's songs from a container, None if the artist has no such album"""
+    try:
+        index = read_album_songs_index(storage, bucket_name, blob_name)
+        if album_id not in index:
+            return None
+        offset, length = index[album_id]
+        return decode_json(storage.read_range(bucket_name, blob_name, offset, offset + length))
+    except Exception as e:
+        logger.error(f"Error reading album {album_id} from {blob_name}: {e}")
+        raise
@@ -0,0 +1,146 @@
+import logging
+from tqdm import tqdm
+import argparse
+import time
+
+from ingestion.utils import get_artists_from_gcs
+from ingestion.spotify_client import get_spotify_client
+from ingestion.track_store import get_track_store
+from ingestion.upload_queue import UploadQueue
+from ingestion.prefetch import prefetch_artist_blobs
+from ingestion.get_songs import process_artist_album_songs, dedupe_single_songs
+from ingestion.get_isrc_and_pop import process_songs_spotify
+from ingestion.group_songs import group_songs
+from ingestion.get_streams import process_artist_streams
+from ingestion.album_songs import group_songs_by_album, put_album_songs
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+"""Fused songs -> ISRC/popularity -> grouping -> streams stages. Each artist's songs and grouped songs are carried
+in memory from one stage to the next instead of round tripping songs.json through the bucket between scripts,
+only the final album songs container, songs.json and grouped_songs.json are written. Checkpointed stages also write
+their songs.json (and grouped_songs.json after grouping) as the separate stage scripts would, so a failed run
+can be resumed with the stage scripts from there."""
+
+BUCKET_NAME = "music--data"
+CHECKPOINT_STAGES = ["songs", "isrc_pop", "grouping"]
+
+
+def write_checkpoint(artist, bucket_name, stage, checkpoints, uploads, songs, grouped_songs=None):
+    """Writes a stage's output right away if the stage is checkpointed. Not queued, so a
+    checkpoint can never land after the final write of the same blob, but written through
+    the queue so the final write compares against the checkpoint."""
+    if stage not in checkpoints:
+        return
+    uploads.write_json_now(bucket_name, f"{artist['full_blob_name']}/songs.json", songs)
+    if grouped_songs is not None:
+        uploads.write_json_now(bucket_name, f"{artist['full_blob_name']}/grouped_songs.json", grouped_songs)
+    logger.info(f"Checkpointed {stage} for artist {artist['artist']}")
+
+
+def run_artist_pipeline(artist, albums, bucket_name, spotify_client, uploads, checkpoints=()):
+    """Runs every songs stage for one artist and queues its album songs container, songs.json and grouped_songs.json"""
+    try:
+        album_songs = process_artist_album_songs(albums, spotify_client)
+        songs = [song for album in album_songs.values() for song in album]
+
+        single_songs = dedupe_single_songs(artist, bucket_name, spotify_client, songs)
+        for album_id, songs_of_single in group_songs_by_album(single_songs).items():
+            album_songs.setdefault(album_id, []).extend(songs_of_single)
+        put_album_songs(uploads, artist, bucket_name, album_songs)
+        songs.extend(single_songs)
+        write_checkpoint(artist, bucket_name, "songs", checkpoints, uploads, songs)
+
+        songs = process_songs_spotify(songs, spotify_client)
+        write_checkpoint(artist, bucket_name, "isrc_pop", checkpoints, uploads, songs)
+
+        grouped_songs = group_songs(artist, bucket_name, songs)
+        write_checkpoint(artist, bucket_name, "grouping", checkpoints, uploads, songs, grouped_songs)
+
+        # Like get_streams, an artist kworb fails for keeps its songs and groups without streams.
+        try:
+            songs, grouped_songs = process_artist_streams(
+                artist, songs, grouped_songs, bucket_name, spotify_client
+            )
+        except Exception as e:
+            logger.error(f"Error matching streams for artist {artist['artist']}, writing it without streams: {e}")
+
+        uploads.put_json(bucket_name, f"{artist['full_blob_name']}/songs.json", songs)
+        uploads.put_json(bucket_name, f"{artist['full_blob_name']}/grouped_songs.json", grouped_songs)
+        logger.info(
+            f"Queued {len(songs)} songs in {len(grouped_songs)} groups for artist {artist['artist']}"
+        )
+    except Exception as e:
+        logger.error(f"Error running the pipeline for artist {artist['artist']}: {e}")
+        raise
+
+
+def run_pipeline_gcs(artists, bucket_name, base_blob_name, spotify_client, checkpoints=()):
+    """Runs the fused songs stages for every artist of a batch"""
+    try:
+        artists_albums = prefetch_artist_blobs(artists, bucket_name, ["albums.json"])
+        with UploadQueue() as uploads:
+            uploads.load_hashes(bucket_name, base_blob_name)
+            for artist, payloads in tqdm(artists_albums, total=len(artists)):
+                # Artists whose albums were all known already have no albums.json.
+                run_artist_pipeline(
+                    artist,
+                    payloads.get("albums.json", []),
+                    bucket_name,
+                    spotify_client,
+                    uploads,
+                    checkpoints,
+                )
+                # Paces the kworb scraping, Spotify calls are paced by the client's rate limiter.
+                time.sleep(0.5)
+
+        spotify_client.log_call_counts()
+        get_track_store().log_stats()
+        logger.info(
+            f"Successfully ran the songs pipeline for {len(artists)} artists to gcs bucket {bucket_name} with base blob name {base_blob_name}"
+        )
+    except Exception as e:
+        logger.error(
+            f"Error running the songs pipeline to gcs bucket {bucket_name} with base blob name {base_blob_name}: {e}"
+        )
+        raise
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--page_number", type=int, default=1)
+    parser.add_argument("--batch_number", type=int, default=1)
+    parser.add_argument(
+        "--num",
+        type=int,
+        default=None,
+        help="Pin a single Spotify credential, by default every configured credential is used",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        choices=CHECKPOINT_STAGES,
+        action="append",
+        default=[],
+        help="Also write songs.json after this stage, can be repeated",
+    )
+    args = parser.parse_args()
+
+    try:
+        client = get_spotify_client(args.num)
+        artists = get_artists_from_gcs(
+            BUCKET_NAME,
+            f"raw-json-data/artists_kworbpage{args.page_number}/batch{args.batch_number}/artists.json",
+        )
+        run_pipeline_gcs(
+            artists,
+            BUCKET_NAME,
+            f"raw-json-data/artists_kworbpage{args.page_number}/batch{args.batch_number}",
+            client,
+            set(args.checkpoint),
+        )
+    except Exception as e:
+        logger.error(f"Error running the script artist_pipeline.py: {e}")
+        raise
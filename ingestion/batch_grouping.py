@@ -0,0 +1,243 @@
+import pandas as pd
+import numpy as np
+import bisect
+import argparse
+import logging
+from tqdm import tqdm
+
+from ingestion.normalizer import normalize_song_name
+from ingestion.utils import get_artists_from_gcs
+from ingestion.get_streams import process_artist_songs_kworb
+from ingestion.upload_queue import UploadQueue
+from ingestion.prefetch import prefetch_artist_blobs
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+"""Batch-wide, columnar version of group_songs + match_streams_to_grouped_songs, meant for re-grouping
+the historical catalog. The groups and the grouped_songs.json it writes are the same as the per-artist pipeline's."""
+
+BUCKET_NAME = "music--data"
+
+SONG_COLUMNS = [
+    "origination_artist_id",
+    "artists",
+    "spotify_artist_ids",
+    "spotify_song_id",
+    "song",
+    "duration_ms",
+    "album",
+    "spotify_popularity",
+    "isrc",
+]
+
+
+def songs_to_frame(songs):
+    """Builds one table from the songs of every artist of a batch, keeping their order in a row column"""
+    df = pd.DataFrame(songs, columns=SONG_COLUMNS)
+    df["row"] = np.arange(len(df))
+    df["isrc"] = df["isrc"].astype(object).where(df["isrc"].notna(), None)
+    df["spotify_popularity"] = df["spotify_popularity"].fillna(0).astype("int64")
+
+    # Titles repeat a lot across variants and artists, so each distinct title is normalized once.
+    codes, titles = pd.factorize(df["song"])
+    normalized_titles = np.array([normalize_song_name(title) for title in titles], dtype=object)
+    df["normalized_name"] = normalized_titles[codes] if len(titles) else ""
+    return df
+
+
+def number_variants(title_codes, durations, threshold):
+    """Variant number of every song, given songs sorted by title and then by song order. Same rule as
+    group_songs: a song joins the lowest numbered variant of its title holding a song less than
+    threshold ms away, or opens a new one."""
+    variant_numbers = np.empty(len(durations), dtype="int64")
+    previous_code = None
+    for i, (code, duration) in enumerate(zip(title_codes.tolist(), durations.tolist())):
+        if code != previous_code:
+            previous_code = code
+            sorted_durations = []
+            sorted_variant_numbers = []
+            variant_count = 0
+        low = bisect.bisect_right(sorted_durations, duration - threshold)
+        high = bisect.bisect_left(sorted_durations, duration + threshold)
+        if low < high:
+            variant_number = min(sorted_variant_numbers[low:high])
+        else:
+            variant_count += 1
+            variant_number = variant_count
+        position = bisect.bisect_right(sorted_durations, duration)
+        sorted_durations.insert(position, duration)
+        sorted_variant_numbers.insert(position, variant_number)
+        variant_numbers[i] = variant_number
+    return variant_numbers
+
+
+def assign_groups(df, threshold=20000):
+    """Adds group_key and group_order columns, grouping like group_songs does for each artist.
+
+    A song whose ISRC an earlier song of the same artist already had joins that song's group. Every
+    other song is numbered within its artist's title by number_variants, in song order."""
+    df = df.sort_values("row", kind="mergesort")
+    has_isrc = df["isrc"].notna() & (df["isrc"] != "")
+    # Only the first song of an (artist, ISRC) goes through the duration rule, later ones follow it.
+    by_duration = ~has_isrc | ~df.duplicated(["origination_artist_id", "isrc"])
+
+    titles = df.loc[by_duration, ["origination_artist_id", "normalized_name", "duration_ms"]]
+    titles["title"] = titles.groupby(["origination_artist_id", "normalized_name"], sort=False).ngroup()
+    titles = titles.sort_values("title", kind="mergesort")
+    variant_number = pd.Series(
+        number_variants(titles["title"].to_numpy(), titles["duration_ms"].to_numpy(), threshold),
+        index=titles.index,
+    )
+    titles["group_key"] = np.where(
+        variant_number == 1,
+        titles["normalized_name"],
+        titles["normalized_name"] + "_variant" + variant_number.astype(str),
+    )
+
+    df["group_key"] = titles["group_key"]
+    df.loc[has_isrc, "group_key"] = (
+        df[has_isrc].groupby(["origination_artist_id", "isrc"], sort=False)["group_key"].transform("first")
+    )
+
+    # Groups are listed in order of their first song, like the keys of group_songs' dict.
+    df["group_order"] = df.groupby(["origination_artist_id", "group_key"], sort=False)["row"].transform("min")
+    return df
+
+
+def attribute_streams(df, kworb_streams):
+    """Hash-joins kworb stream counts onto the songs, gives every variant its group's top count and
+    picks the canonical variant: most streamed, or most popular when no variant is on kworb."""
+    df = df.merge(
+        kworb_streams, on=["origination_artist_id", "spotify_song_id"], how="left"
+    )
+    df = df.sort_values("row", kind="mergesort").reset_index(drop=True)
+    group_columns = ["origination_artist_id", "group_key"]
+
+    df["total_streams"] = (
+        df.groupby(group_columns)["kworb_streams"].transform("max").fillna(0).astype("int64")
+    )
+
+    on_kworb = df["kworb_streams"].notna()
+    by_streams = df[on_kworb].groupby(group_columns)["kworb_streams"].idxmax()
+    streamed_groups = df.loc[by_streams, group_columns]
+    not_streamed = ~df.set_index(group_columns).index.isin(
+        pd.MultiIndex.from_frame(streamed_groups)
+    )
+    by_popularity = df[not_streamed].groupby(group_columns)["spotify_popularity"].idxmax()
+
+    df["canonical"] = False
+    df.loc[by_streams.tolist() + by_popularity.tolist(), "canonical"] = True
+    return df.drop(columns=["kworb_streams"])
+
+
+def frame_to_grouped_songs(df):
+    """Serializes the table back into {spotify_artist_id: grouped_songs} in the grouped_songs.json shape"""
+    grouped_songs_by_artist = {}
+    df = df.sort_values(["group_order", "row"], kind="mergesort")
+    for song in df.itertuples(index=False):
+        grouped_songs = grouped_songs_by_artist.setdefault(song.origination_artist_id, {})
+        grouped_songs.setdefault(song.group_key, {"variants": []})["variants"].append(
+            {
+                "artists": song.artists,
+                "artist_ids": song.spotify_artist_ids,
+                "spotify_song_id": song.spotify_song_id,
+                "song": song.song,
+                "duration_ms": int(song.duration_ms),
+                "album": song.album,
+                "spotify_popularity": int(song.spotify_popularity),
+                "isrc": song.isrc,
+                "total_streams": int(song.total_streams),
+                "canonical": bool(song.canonical),
+            }
+        )
+    return grouped_songs_by_artist
+
+
+def group_batch(songs, kworb_songs_by_artist, threshold=20000):
+    """Groups every song of a batch and attributes kworb streams in one columnar pass.
+    kworb_songs_by_artist maps spotify_artist_id to {spotify_song_id: total_streams}."""
+    try:
+        kworb_streams = pd.DataFrame(
+            [
+                (artist_id, song_id, streams)
+                for artist_id, kworb_songs in kworb_songs_by_artist.items()
+                for song_id, streams in kworb_songs.items()
+            ],
+            columns=["origination_artist_id", "spotify_song_id", "kworb_streams"],
+        ).drop_duplicates(subset=["origination_artist_id", "spotify_song_id"])
+
+        df = songs_to_frame(songs)
+        df = assign_groups(df, threshold)
+        df = attribute_streams(df, kworb_streams)
+        return df
+    except Exception as e:
+        logger.error(f"Error grouping batch of {len(songs)} songs: {e}")
+        raise
+
+
+def regroup_batch_gcs(artists, bucket_name, base_blob_name):
+    """Re-groups the stored songs of a batch and rewrites songs.json and grouped_songs.json per artist.
+    Unlike get_streams it does not backfill tracks that are on kworb but missing from songs.json."""
+    try:
+        songs_by_artist = {}
+        kworb_songs_by_artist = {}
+        artists_songs = prefetch_artist_blobs(artists, bucket_name, ["songs.json"])
+        for artist, payloads in tqdm(artists_songs, total=len(artists), ncols=100, leave=True):
+            songs_by_artist[artist["spotify_artist_id"]] = payloads.get("songs.json", [])
+            kworb_songs_by_artist[artist["spotify_artist_id"]] = process_artist_songs_kworb(artist)
+
+        songs = [song for artist_songs in songs_by_artist.values() for song in artist_songs]
+        df = group_batch(songs, kworb_songs_by_artist)
+        grouped_songs_by_artist = frame_to_grouped_songs(df)
+        streams_by_song = dict(
+            zip(zip(df["origination_artist_id"], df["spotify_song_id"]), df["total_streams"])
+        )
+
+        with UploadQueue() as uploads:
+            uploads.load_hashes(bucket_name, base_blob_name)
+            for artist in artists:
+                artist_songs = songs_by_artist[artist["spotify_artist_id"]]
+                for song in artist_songs:
+                    song["total_streams"] = int(
+                        streams_by_song[(song["origination_artist_id"], song["spotify_song_id"])]
+                    )
+
+                uploads.put_json(bucket_name, f"{artist['full_blob_name']}/songs.json", artist_songs)
+                uploads.put_json(
+                    bucket_name,
+                    f"{artist['full_blob_name']}/grouped_songs.json",
+                    grouped_songs_by_artist.get(artist["spotify_artist_id"], {}),
+                )
+
+        logger.info(
+            f"Successfully regrouped {len(songs)} songs for {len(artists)} artists to gcs bucket {bucket_name} with base blob name {base_blob_name}"
+        )
+    except Exception as e:
+        logger.error(
+            f"Error regrouping songs in gcs bucket {bucket_name} with base blob name {base_blob_name}: {e}"
+        )
+        raise
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--page_number", type=int, default=1)
+    parser.add_argument("--batch_number", type=int, default=1)
+    args = parser.parse_args()
+
+    try:
+        artists = get_artists_from_gcs(
+            BUCKET_NAME,
+            f"raw-json-data/artists_kworbpage{args.page_number}/batch{args.batch_number}/artists.json",
+        )
+        regroup_batch_gcs(
+            artists,
+            BUCKET_NAME,
+            f"raw-json-data/artists_kworbpage{args.page_number}/batch{args.batch_number}",
+        )
+    except Exception as e:
+        logger.error(f"Error running the script batch_grouping.py: {e}")
+        raise
@@ -0,0 +1,94 @@
+import gzip
+import os
+import orjson
+import zstandard
+
+"""Encoding of the raw layer's json blobs: compact orjson, compressed with zstd (default) or gzip, RAW_COMPRESSION=none
+writes plain json. Songs lists keep each album's image urls once instead of in every song. Decoding recognizes the
+compression from the blob's first bytes, so blobs written before this codec (indented, uncompressed) still read."""
+
+RAW_COMPRESSION = os.getenv("RAW_COMPRESSION", "zstd")
+ZSTD_LEVEL = 3
+GZIP_LEVEL = 6
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+ALBUM_IMAGES_KEY = "$album_images"
+SONGS_KEY = "$songs"
+
+
+def is_songs_list(data):
+    """Whether data is a list of songs, the only blobs repeating their album's images"""
+    return (
+        isinstance(data, list)
+        and len(data) > 0
+        and all(
+            isinstance(item, dict)
+            and "spotify_song_id" in item
+            and "images" in item
+            and isinstance(item.get("spotify_album_id"), str)
+            for item in data
+        )
+    )
+
+
+def pack_songs(songs):
+    """Moves the songs' images into one {album id: images} map. A song whose images differ from its
+    album's entry (e.g. a cached or backfilled track) keeps its own."""
+    album_images = {}
+    packed = []
+    for song in songs:
+        images = album_images.setdefault(song["spotify_album_id"], song["images"])
+        if song["images"] == images:
+            packed.append({key: value for key, value in song.items() if key != "images"})
+        else:
+            packed.append(song)
+    return {ALBUM_IMAGES_KEY: album_images, SONGS_KEY: packed}
+
+
+def unpack_songs(data):
+    """Re-attaches the album images to every song"""
+    album_images = data[ALBUM_IMAGES_KEY]
+    songs = data[SONGS_KEY]
+    for song in songs:
+        song.setdefault("images", list(album_images.get(song["spotify_album_id"], [])))
+    return songs
+
+
+def content_encoding(data):
+    """The Content-Encoding of encoded bytes, None for plain json"""
+    if data[:4] == ZSTD_MAGIC:
+        return "zstd"
+    if data[:2] == GZIP_MAGIC:
+        return "gzip"
+    return None
+
+
+def encode_json(data, compression=RAW_COMPRESSION):
+    """Serializes a json blob's content"""
+    if is_songs_list(data):
+        data = pack_songs(data)
+    encoded = orjson.dumps(data)
+    if compression == "zstd":
+        # A compressor per call, compressor objects aren't thread safe and encode_json may be called from any thread.
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(encoded)
+    if compression == "gzip":
+        # mtime=0 keeps the bytes, and so the blob's hash, identical for identical content.
+        return gzip.compress(encoded, compresslevel=GZIP_LEVEL, mtime=0)
+    if compression == "none":
+        return encoded
+    raise ValueError(f"Unknown raw compression {compression}, expected zstd, gzip or none")
+
+
+def decode_json(data):
+    """Parses a json blob's content, whichever way it was encoded"""
+    encoding = content_encoding(data)
+    if encoding == "zstd":
+        data = zstandard.ZstdDecompressor().decompress(data)
+    elif encoding == "gzip":
+        data = gzip.decompress(data)
+    decoded = orjson.loads(data)
+    if isinstance(decoded, dict) and SONGS_KEY in decoded and ALBUM_IMAGES_KEY in decoded:
+        return unpack_songs(decoded)
+    return decoded
@@ -0,0 +1,226 @@
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+import argparse
+import json
+import logging
+import time
+
+from ingestion.parquet_dataset import TABLES, table_root, relative_path
+from ingestion.storage import get_storage
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+"""Compacts the per batch files of the parquet dataset into large files deduplicated across batches.
+
+Each table's parquet_compacted/{table}/_manifest.json records the batch files already compacted (with
+their last update time, so rerun batches are picked up again) and the compacted files readers should open.
+A run only reads batches that are new since the last one, drops the keys they redefine from the compacted
+files holding them and writes the new rows into target sized files."""
+
+BUCKET_NAME = "music--data"
+COMPACTED_PREFIX = "parquet_compacted"
+TARGET_FILE_MB = 128
+PARQUET_COMPRESSION = "zstd"
+PARQUET_ROW_GROUP_SIZE = 128_000
+
+KEY_COLUMNS = {
+    "artists": ["spotify_artist_id"],
+    "albums": ["spotify_album_id"],
+    "songs": ["spotify_song_id"],
+    "song_groups": ["origination_artist_id", "group_key"],
+}
+
+
+def compacted_root(bucket_name, table):
+    """Path of a table's compacted files on the storage filesystem"""
+    return f"{bucket_name}/{COMPACTED_PREFIX}/{table}"
+
+
+def read_manifest(filesystem, bucket_name, table):
+    """Returns the table's manifest, empty before the first compaction"""
+    path = f"{compacted_root(bucket_name, table)}/_manifest.json"
+    if not filesystem.exists(path):
+        return {"generation": 0, "batches": {}, "files": []}
+    with filesystem.open(path, "rb") as file:
+        return json.load(file)
+
+
+def write_manifest(filesystem, bucket_name, table, manifest):
+    """Writes the manifest, which is what makes a compaction visible to readers"""
+    with filesystem.open(f"{compacted_root(bucket_name, table)}/_manifest.json", "wb") as file:
+        file.write(json.dumps(manifest, indent=3).encode("utf-8"))
+
+
+def list_batch_files(filesystem, bucket_name, table):
+    """Returns {path relative to the dataset table root: last update time} for every batch file"""
+    root = table_root(bucket_name, table)
+    batch_files = {}
+    for path, info in filesystem.find(root, detail=True).items():
+        name = path.rsplit("/", 1)[-1]
+        if name.endswith(".parquet") and not name.startswith("_"):
+            batch_files[relative_path(path, root)] = str(info.get("updated") or info.get("mtime") or info.get("created"))
+    return batch_files
+
+
+def key_array(table, key_columns):
+    """One string key per row, joining composite keys with a unit separator"""
+    if len(key_columns) == 1:
+        return table[key_columns[0]]
+    return pc.binary_join_element_wise(*(table[column] for column in key_columns), "\x1f")
+
+
+def keep_latest(table, key_columns):
+    """Keeps the last row of every key, rows being ordered oldest to newest"""
+    keys = key_array(table, key_columns)
+    indexed = pa.table({"key": keys, "row": pa.array(range(table.num_rows), pa.int64())})
+    last_rows = indexed.group_by("key", use_threads=False).aggregate([("row", "max")])["row_max"]
+    return table.take(pc.take(last_rows, pc.sort_indices(last_rows)))
+
+
+def bytes_per_row(metadata):
+    """Compressed bytes per row, from a parquet footer"""
+    compressed = sum(
+        metadata.row_group(i).column(j).total_compressed_size
+        for i in range(metadata.num_row_groups)
+        for j in range(metadata.num_columns)
+    )
+    return compressed / max(metadata.num_rows, 1)
+
+
+def read_parquet_file(filesystem, path):
+    """Reads a parquet file and returns it with its footer"""
+    with filesystem.open(path, "rb") as file:
+        parquet_file = pq.ParquetFile(file)
+        return parquet_file.read(), parquet_file.metadata
+
+
+def write_compacted_files(filesystem, root, table, generation, rows_per_file):
+    """Writes table into files of at most rows_per_file rows, returns their names"""
+    names = []
+    for index, start in enumerate(range(0, table.num_rows, rows_per_file)):
+        name = f"part-{generation:05d}-{index:04d}.parquet"
+        with filesystem.open(f"{root}/{name}", "wb") as file:
+            pq.write_table(
+                table.slice(start, rows_per_file),
+                file,
+                compression=PARQUET_COMPRESSION,
+                row_group_size=PARQUET_ROW_GROUP_SIZE,
+                write_statistics=True,
+            )
+        names.append(name)
+    return names
+
+
+def compact_table(filesystem, bucket_name, table, target_file_mb=TARGET_FILE_MB):
+    """Compacts the batches of a table that are new or rewritten since the last compaction"""
+    try:
+        start = time.perf_counter()
+        key_columns = KEY_COLUMNS[table]
+        root = compacted_root(bucket_name, table)
+        manifest = read_manifest(filesystem, bucket_name, table)
+
+        batch_files = list_batch_files(filesystem, bucket_name, table)
+        new_batches = sorted(
+            (path for path, updated in batch_files.items() if manifest["batches"].get(path) != updated),
+            key=lambda path: batch_files[path],
+        )
+        if not new_batches:
+            logger.info(f"No new {table} batches since the last compaction.")
+            return
+
+        # Oldest batches first, so the latest record of a key is its last row.
+        tables = []
+        row_sizes = []
+        for path in new_batches:
+            batch_table, metadata = read_parquet_file(
+                filesystem, f"{table_root(bucket_name, table)}/{path}"
+            )
+            tables.append(batch_table)
+            row_sizes.append((bytes_per_row(metadata), metadata.num_rows))
+        new_rows = pa.concat_tables(tables, promote_options="default")
+        initial_count = new_rows.num_rows
+        new_rows = keep_latest(new_rows, key_columns)
+        new_keys = key_array(new_rows, key_columns)
+
+        # Compacted files holding a redefined key are rewritten without it; a small trailing file
+        # is folded into this generation so increments don't leave a tail of small files.
+        generation = manifest["generation"] + 1
+        kept_files = []
+        carried = []
+        replaced = []
+        for index, name in enumerate(manifest["files"]):
+            path = f"{root}/{name}"
+            with filesystem.open(path, "rb") as file:
+                parquet_file = pq.ParquetFile(file)
+                existing_keys = key_array(parquet_file.read(columns=key_columns), key_columns)
+                is_last = index == len(manifest["files"]) - 1
+                file_bytes = bytes_per_row(parquet_file.metadata) * parquet_file.metadata.num_rows
+                small = is_last and file_bytes < target_file_mb * (1 << 20) / 2
+                overlaps = pc.any(pc.is_in(existing_keys, value_set=new_keys)).as_py()
+                if not overlaps and not small:
+                    kept_files.append(name)
+                    continue
+                existing = parquet_file.read()
+            carried.append(existing.filter(pc.invert(pc.is_in(existing_keys, value_set=new_keys))))
+            replaced.append(name)
+
+        output = pa.concat_tables(carried + [new_rows], promote_options="default")
+        average_row_bytes = sum(size * rows for size, rows in row_sizes) / max(
+            sum(rows for _, rows in row_sizes), 1
+        )
+        rows_per_file = max(1, int(target_file_mb * (1 << 20) / max(average_row_bytes, 1)))
+        written = write_compacted_files(filesystem, root, output, generation, rows_per_file)
+
+        manifest["generation"] = generation
+        manifest["files"] = kept_files + written
+        for path in new_batches:
+            manifest["batches"][path] = batch_files[path]
+        write_manifest(filesystem, bucket_name, table, manifest)
+
+        # Only removed once the manifest no longer points at them.
+        for name in replaced:
+            filesystem.rm(f"{root}/{name}")
+
+        logger.info(
+            f"Compacted {len(new_batches)} {table} batches: {initial_count} rows, {initial_count - new_rows.num_rows} duplicates dropped, "
+            f"{len(replaced)} files rewritten, {len(written)} files written, {len(manifest['files'])} files in total in {time.perf_counter() - start:.2f}s."
+        )
+    except Exception as e:
+        logger.error(f"Error compacting {table}: {e}")
+        raise
+
+
+def open_compacted_dataset(table, bucket_name=BUCKET_NAME, filesystem=None):
+    """Opens the compacted files of a table listed in its manifest as a pyarrow dataset"""
+    try:
+        filesystem = filesystem or get_storage().fs
+        manifest = read_manifest(filesystem, bucket_name, table)
+        root = compacted_root(bucket_name, table)
+        return ds.dataset(
+            [f"{root}/{name}" for name in manifest["files"]],
+            filesystem=filesystem,
+            format="parquet",
+        )
+    except Exception as e:
+        logger.error(f"Error opening compacted dataset {table}: {e}")
+        raise
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--table", choices=TABLES, action="append", help="Tables to compact, defaults to all")
+    parser.add_argument("--target_mb", type=int, default=TARGET_FILE_MB, help="Target size of a compacted file")
+    args = parser.parse_args()
+
+    try:
+        fs = get_storage().fs
+        for table in args.table or TABLES:
+            compact_table(fs, BUCKET_NAME, table, args.target_mb)
+    except Exception as e:
+        logger.error(f"Error running the script compact_parquet.py: {e}")
+        raise
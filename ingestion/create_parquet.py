@@ -1,129 +1,316 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import argparse
-from io import BytesIO
-from google.cloud import storage
 import logging
-import json
-import gcsfs
 from tqdm import tqdm
 import numpy as np
-import requests
-import logging
-import time
+from itertools import islice
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s"
 )
 
-from ingestion.utils import (
-    get_artists_from_gcs,
-    get_albums_from_gcs,
-    get_artist_songs_from_gcs,
+from ingestion.utils import get_artists_from_gcs
+from ingestion.prefetch import prefetch_artist_blobs
+from ingestion.parquet_dataset import partition_blob_name, temporary_blob_name, update_dataset_metadata
+from ingestion.storage import get_storage
+
+BUCKET_NAME = "music--data"
+
+PARQUET_COMPRESSION = "zstd"
+PARQUET_COMPRESSION_LEVEL = 3
+PARQUET_ROW_GROUP_SIZE = 128_000
+# Artists whose songs are read and converted together when streaming songs.parquet.
+SONGS_CHUNK_SIZE = 25
+
+STRING_LIST = pa.list_(pa.string())
+# Low cardinality labels such as album_type and release_date_precision.
+CATEGORY = pa.dictionary(pa.int8(), pa.string())
+
+ARTISTS_SCHEMA = pa.schema(
+    [
+        ("spotify_artist_id", pa.string()),
+        ("artist", pa.string()),
+        ("monthly_listeners", pa.int64()),
+        ("followers", pa.int64()),
+        ("popularity", pa.int32()),
+        ("genres", STRING_LIST),
+        ("images", STRING_LIST),
+    ]
+)
+ALBUMS_SCHEMA = pa.schema(
+    [
+        ("spotify_album_id", pa.string()),
+        ("album", pa.string()),
+        ("artists", STRING_LIST),
+        ("spotify_artist_ids", STRING_LIST),
+        ("album_type", CATEGORY),
+        ("release_date", pa.date32()),
+        ("release_date_precision", CATEGORY),
+        ("total_tracks", pa.int32()),
+        ("images", STRING_LIST),
+    ]
+)
+SONGS_SCHEMA = pa.schema(
+    [
+        ("spotify_song_id", pa.string()),
+        ("spotify_album_id", pa.string()),
+        ("song", pa.string()),
+        ("album", pa.string()),
+        ("origination_artist_id", pa.string()),
+        ("artists", STRING_LIST),
+        ("spotify_artist_ids", STRING_LIST),
+        ("release_date_precision", CATEGORY),
+        ("release_date", pa.date32()),
+        ("duration_ms", pa.int32()),
+        ("explicit", pa.bool_()),
+        ("images", STRING_LIST),
+        ("isrc", pa.string()),
+        ("total_streams", pa.int64()),
+        ("popularity", pa.int32()),
+    ]
+)
+SONG_GROUPS_SCHEMA = pa.schema(
+    [
+        ("origination_artist_id", pa.string()),
+        ("group_key", pa.string()),
+        ("song", pa.string()),
+        ("canonical_spotify_song_id", pa.string()),
+        ("isrc", pa.string()),
+        ("variant_spotify_song_ids", STRING_LIST),
+        ("variant_count", pa.int32()),
+        ("total_streams", pa.int64()),
+        ("popularity", pa.int32()),
+    ]
 )
 
-fs = gcsfs.GCSFileSystem()
-pd.set_option("display.max_columns", None)
-pd.set_option("display.max_colwidth", None)
 
-BUCKET_NAME = "music--data"
+def records_to_table(records, schema):
+    """Builds an arrow table with a fixed schema straight from a list of dicts.
+    Keys missing from a record become nulls, or empty lists for list columns."""
+    arrays = []
+    for field in schema:
+        values = [record.get(field.name) for record in records]
+        if pa.types.is_list(field.type):
+            values = [value if value is not None else [] for value in values]
+        if pa.types.is_date(field.type):
+            # Release dates are already normalized to YYYY-MM-DD strings.
+            arrays.append(pa.array(values, pa.string()).cast(field.type))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def dedupe_records(records, key, seen=None):
+    """Drops records whose key was already seen, keeping the first one. Pass seen to dedupe across calls."""
+    seen = set() if seen is None else seen
+    deduped = []
+    for record in records:
+        if record[key] not in seen:
+            seen.add(record[key])
+            deduped.append(record)
+    return deduped
+
+
+def upload_parquet(table, bucket_name, blob_name):
+    """Writes table as zstd parquet with sized row groups and column statistics and uploads it"""
+    buffer = pa.BufferOutputStream()
+    pq.write_table(
+        table,
+        buffer,
+        compression=PARQUET_COMPRESSION,
+        compression_level=PARQUET_COMPRESSION_LEVEL,
+        row_group_size=PARQUET_ROW_GROUP_SIZE,
+        write_statistics=True,
+    )
+    get_storage().write(
+        bucket_name, blob_name, buffer.getvalue().to_pybytes(), content_type="application/parquet"
+    )
 
 
-def create_artists_metadata_parquet(artists, bucket_name, base_blob_name):
+def song_popularity(records):
+    """Runs the song popularity rules over records carrying total_streams and spotify_popularity"""
+    df = pd.DataFrame(
+        {
+            "total_streams": pd.Series(
+                [record.get("total_streams") for record in records], dtype="float64"
+            ),
+            "spotify_popularity": pd.Series(
+                [record.get("spotify_popularity") for record in records], dtype="float64"
+            ),
+        }
+    )
+    df = add_song_popularity(df)
+    df = override_song_popularity(df)
+    df = add_spotify_song_popularity(df)
+    return [None if pd.isna(popularity) else int(popularity) for popularity in df["popularity"]]
+
+
+def create_artists_metadata_parquet(artists, bucket_name, page_number, batch_number):
     """Create and upload artists.parquet with calculated artist popularity."""
     try:
-        df = pd.json_normalize(artists)
+        initial_count = len(artists)
+        artists = dedupe_records(artists, "spotify_artist_id")
+        duplicates_dropped = initial_count - len(artists)
+        final_count = len(artists)
 
-        initial_count = len(df)
+        df = pd.DataFrame(
+            {"followers": pd.Series([artist.get("followers") for artist in artists], dtype="float64")}
+        )
         df = add_artist_popularity(df)
+        for artist, popularity in zip(artists, df["popularity"]):
+            artist["popularity"] = None if pd.isna(popularity) else int(popularity)
+        table = records_to_table(artists, ARTISTS_SCHEMA)
 
-        df.drop(columns=["full_blob_name"], errors="ignore", inplace=True)
-        df = df.drop_duplicates(subset=["spotify_artist_id"])
-        duplicates_dropped = initial_count - len(df)
-        final_count = len(df)
-
-        buffer = BytesIO()
-        df.to_parquet(buffer, index=False)
-        buffer.seek(0)
-
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(f"{base_blob_name}/artists.parquet")
-        blob.upload_from_file(buffer, content_type="application/parquet")
+        blob_name = partition_blob_name("artists", page_number, batch_number)
+        upload_parquet(table, bucket_name, blob_name)
+        update_dataset_metadata(get_storage().fs, bucket_name, "artists", blob_name, ARTISTS_SCHEMA)
         logger.info(f"Artists stats: {initial_count} initial, {duplicates_dropped} duplicates dropped, {final_count} final.")
-        logger.info(f"Successfully wrote artists metadata parquet to gcs bucket {bucket_name} with blob name {base_blob_name}/artists.parquet.")
+        logger.info(f"Successfully wrote artists metadata parquet to gcs bucket {bucket_name} with blob name {blob_name}.")
     except Exception as e:
         logger.error(f"Error creating artists metadata parquet: {e}")
         raise
 
 
-def create_albums_metadata_parquet(artists, bucket_name, base_blob_name):
+def create_albums_metadata_parquet(artists, bucket_name, page_number, batch_number):
     """Create and upload albums.parquet from artists' album JSON."""
     try:
         albums = []
-        for artist in tqdm(artists, ncols=100, leave=True):
-            artist_albums = get_albums_from_gcs(artist, bucket_name)
-            albums.extend(artist_albums)
+        artists_albums = prefetch_artist_blobs(artists, bucket_name, ["albums.json"])
+        for _, payloads in tqdm(artists_albums, total=len(artists), ncols=100, leave=True):
+            albums.extend(payloads.get("albums.json", []))
 
         initial_count = len(albums)
-        df = pd.json_normalize(albums)
-
-        df.drop(columns=["origination_artist_id"], errors="ignore", inplace=True)
-        df = df.drop_duplicates(subset=["spotify_album_id"])
-        duplicates_dropped = initial_count - len(df)
-        final_count = len(df)
+        albums = dedupe_records(albums, "spotify_album_id")
+        duplicates_dropped = initial_count - len(albums)
+        final_count = len(albums)
 
-        buffer = BytesIO()
-        df.to_parquet(buffer, index=False)
-        buffer.seek(0)
+        table = records_to_table(albums, ALBUMS_SCHEMA)
 
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(f"{base_blob_name}/albums.parquet")
-        blob.upload_from_file(buffer, content_type="application/parquet")
+        blob_name = partition_blob_name("albums", page_number, batch_number)
+        upload_parquet(table, bucket_name, blob_name)
+        update_dataset_metadata(get_storage().fs, bucket_name, "albums", blob_name, ALBUMS_SCHEMA)
         logger.info(f"Albums stats: {initial_count} initial, {duplicates_dropped} duplicates dropped, {final_count} final.")
-        logger.info(f"Successfully wrote albums metadata parquet to gcs bucket {bucket_name} with blob name {base_blob_name}/albums.parquet.")
+        logger.info(f"Successfully wrote albums metadata parquet to gcs bucket {bucket_name} with blob name {blob_name}.")
     except Exception as e:
         logger.error(f"Error creating albums metadata parquet: {e}")
         raise
 
 
-def create_songs_metadata_parquet(artists, bucket_name, base_blob_name):
-    """Create and upload songs.parquet with adjusted popularity columns."""
+def create_songs_metadata_parquet(artists, bucket_name, page_number, batch_number, chunk_size=SONGS_CHUNK_SIZE):
+    """Create and upload songs.parquet with adjusted popularity columns.
+
+    Artists are read chunk_size at a time and their songs are appended to a parquet file opened on
+    the bucket as row groups fill up, so memory stays flat regardless of the batch size. The file is
+    written under a temporary name and only replaces the batch's songs.parquet once it is complete.
+    """
     try:
-        songs = []
-        for artist in tqdm(artists, ncols=100, leave=True):
-            artist_songs = get_artist_songs_from_gcs(artist, bucket_name)
-            songs.extend(artist_songs)
-
-        initial_count = len(songs)
-        df = pd.json_normalize(songs)
-
-        zero_streams_count = (df["total_streams"] == 0).sum()
-        df = add_song_popularity(df)
-        df = override_song_popularity(df)
-        df = add_spotify_song_popularity(df)
-
-        df.drop(columns=["spotify_popularity"], errors="ignore", inplace=True)
-        df = df.drop_duplicates(subset=["spotify_song_id"])
-        duplicates_dropped = initial_count - len(df)
-        final_count = len(df)
-
-        buffer = BytesIO()
-        df.to_parquet(buffer, index=False)
-        buffer.seek(0)
-
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(f"{base_blob_name}/songs.parquet")
-        blob.upload_from_file(buffer, content_type="application/parquet")
+        initial_count = 0
+        zero_streams_count = 0
+        final_count = 0
+        seen_song_ids = set()
+        pending_tables = []
+        pending_rows = 0
+
+        storage = get_storage()
+        blob_name = partition_blob_name("songs", page_number, batch_number)
+        temporary_name = temporary_blob_name(blob_name)
+        try:
+            with storage.open(bucket_name, temporary_name, "wb") as file, pq.ParquetWriter(
+                file,
+                SONGS_SCHEMA,
+                compression=PARQUET_COMPRESSION,
+                compression_level=PARQUET_COMPRESSION_LEVEL,
+                write_statistics=True,
+            ) as writer:
+                artists_songs = prefetch_artist_blobs(artists, bucket_name, ["songs.json"])
+                for i in tqdm(range(0, len(artists), chunk_size), ncols=100, leave=True):
+                    songs = []
+                    for _, payloads in islice(artists_songs, chunk_size):
+                        songs.extend(payloads.get("songs.json", []))
+
+                    initial_count += len(songs)
+                    zero_streams_count += sum(1 for song in songs if song.get("total_streams") == 0)
+                    songs = dedupe_records(songs, "spotify_song_id", seen_song_ids)
+                    final_count += len(songs)
+
+                    for song, popularity in zip(songs, song_popularity(songs)):
+                        song["popularity"] = popularity
+                    pending_tables.append(records_to_table(songs, SONGS_SCHEMA))
+                    pending_rows += len(songs)
+
+                    # Only full row groups are written, the remainder waits for the next chunk.
+                    if pending_rows >= PARQUET_ROW_GROUP_SIZE:
+                        table = pa.concat_tables(pending_tables)
+                        full_rows = pending_rows - pending_rows % PARQUET_ROW_GROUP_SIZE
+                        writer.write_table(table.slice(0, full_rows), row_group_size=PARQUET_ROW_GROUP_SIZE)
+                        pending_tables = [table.slice(full_rows)]
+                        pending_rows -= full_rows
+
+                if pending_rows:
+                    writer.write_table(pa.concat_tables(pending_tables), row_group_size=PARQUET_ROW_GROUP_SIZE)
+        except Exception:
+            # The writer and file close on the way out, leaving a partial file behind.
+            if storage.exists(bucket_name, temporary_name):
+                storage.delete(bucket_name, temporary_name)
+            raise
+        storage.move(bucket_name, temporary_name, blob_name)
+
+        update_dataset_metadata(storage.fs, bucket_name, "songs", blob_name, SONGS_SCHEMA)
+
+        duplicates_dropped = initial_count - final_count
         logger.info(f"Songs stats: {initial_count} initial, {zero_streams_count} songs with zero streams (used Spotify popularity), {duplicates_dropped} duplicates dropped, {final_count} final.")
-        logger.info(f"Successfully wrote songs metadata parquet to gcs bucket {bucket_name} with blob name {base_blob_name}/songs.parquet.")
+        logger.info(f"Successfully wrote songs metadata parquet to gcs bucket {bucket_name} with blob name {blob_name}.")
     except Exception as e:
         logger.error(f"Error creating songs metadata parquet: {e}")
         raise
 
 
+def create_song_groups_metadata_parquet(artists, bucket_name, page_number, batch_number):
+    """Create and upload song_groups.parquet, one row per grouped song described by its canonical variant."""
+    try:
+        groups = []
+        artists_grouped_songs = prefetch_artist_blobs(artists, bucket_name, ["grouped_songs.json"])
+        for artist, payloads in tqdm(artists_grouped_songs, total=len(artists), ncols=100, leave=True):
+            grouped_songs = payloads.get("grouped_songs.json", {})
+            for group_key, song_data in grouped_songs.items():
+                variants = song_data["variants"]
+                canonical = next(
+                    (variant for variant in variants if variant.get("canonical")),
+                    variants[0],
+                )
+                groups.append(
+                    {
+                        "origination_artist_id": artist["spotify_artist_id"],
+                        "group_key": group_key,
+                        "song": canonical["song"],
+                        "canonical_spotify_song_id": canonical["spotify_song_id"],
+                        "isrc": canonical["isrc"],
+                        "variant_spotify_song_ids": [
+                            variant["spotify_song_id"] for variant in variants
+                        ],
+                        "variant_count": len(variants),
+                        "total_streams": canonical.get("total_streams", 0),
+                        "spotify_popularity": canonical["spotify_popularity"],
+                    }
+                )
+
+        for group, popularity in zip(groups, song_popularity(groups)):
+            group["popularity"] = popularity
+        table = records_to_table(groups, SONG_GROUPS_SCHEMA)
+
+        blob_name = partition_blob_name("song_groups", page_number, batch_number)
+        upload_parquet(table, bucket_name, blob_name)
+        update_dataset_metadata(get_storage().fs, bucket_name, "song_groups", blob_name, SONG_GROUPS_SCHEMA)
+        logger.info(f"Song groups stats: {len(groups)} groups for {len(artists)} artists.")
+        logger.info(f"Successfully wrote song groups metadata parquet to gcs bucket {bucket_name} with blob name {blob_name}.")
+    except Exception as e:
+        logger.error(f"Error creating song groups metadata parquet: {e}")
+        raise
+
+
 def add_artist_popularity(df):
     """Compute artist popularity from follower count using an interpolation table."""
     try:
@@ -230,16 +417,6 @@ def add_spotify_song_popularity(df):
         raise
 
 
-def read_parquet():
-    """Debug helper to read a songs parquet file for a specific page/batch."""
-    df = pd.read_parquet(
-        f"gs://music--data/parquet_metadata/artists_kworbpage{args.page_number}/batch{args.batch_number}/albums.parquet",
-        filesystem=fs,
-    )
-    print(len(df[df["release_precision"] == "month"]))
-    print(df[df["release_precision"] == "month"])
-
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--page_number", type=int, default=1)
@@ -254,19 +431,27 @@ if __name__ == "__main__":
         create_artists_metadata_parquet(
             artists,
             BUCKET_NAME,
-            f"parquet_metadata/artists_kworbpage{args.page_number}/batch{args.batch_number}",
+            args.page_number,
+            args.batch_number,
         )
         create_albums_metadata_parquet(
             artists,
             BUCKET_NAME,
-            f"parquet_metadata/artists_kworbpage{args.page_number}/batch{args.batch_number}",
+            args.page_number,
+            args.batch_number,
         )
         create_songs_metadata_parquet(
             artists,
             BUCKET_NAME,
-            f"parquet_metadata/artists_kworbpage{args.page_number}/batch{args.batch_number}",
+            args.page_number,
+            args.batch_number,
+        )
+        create_song_groups_metadata_parquet(
+            artists,
+            BUCKET_NAME,
+            args.page_number,
+            args.batch_number,
         )
-        # read_parquet()
     except Exception as e:
         logger.error(f"Error creating parquet: {e}")
         raise
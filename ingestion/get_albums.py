@@ -1,15 +1,13 @@
-from google.cloud import storage
-import requests
-import json
 import logging
-import time
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
 import argparse
 import psycopg2
-from db.db import get_connection
+from db.db import get_missing_ids
 
-from auth import get_spotify_access_token
+from ingestion.spotify_client import get_spotify_client
 from ingestion.utils import get_artists_from_gcs, normalize_release_date
+from ingestion.upload_queue import UploadQueue
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s"
@@ -17,61 +15,43 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 BUCKET_NAME = "music--data"
+ALBUMS_PAGE_SIZE = 50
 
 
-def fetch_albums_spotify(spotify_artist_id, token, max_retries=2, sleep_time=1):
-    """Gets the albums from the spotify api for a given artist"""
-    url = f"https://api.spotify.com/v1/artists/{spotify_artist_id}/albums"
-    headers = {"Authorization": f"Bearer {token}"}
-    params = {"limit": 50, "include_groups": "album,single", "market": "US"}
+def fetch_albums_spotify(spotify_artist_id, client, page_executor=None):
+    """Gets the albums from the spotify api for a given artist. The first page gives the total,
+    the remaining offsets are fetched in parallel on page_executor when one is passed."""
+    try:
+        data = client.get_artist_albums(spotify_artist_id, limit=ALBUMS_PAGE_SIZE)
+        all_album_items = list(data.get("items", []))
 
-    all_album_items = []
-    page_url, page_params = url, params
+        offsets = range(ALBUMS_PAGE_SIZE, data.get("total", 0), ALBUMS_PAGE_SIZE)
 
-    while True:
-        success = False
-        last_exception = None
-        for attempt in range(max_retries):
-            try:
-                response = requests.get(
-                    page_url, headers=headers, params=page_params, timeout=10
-                )
-                if response.status_code == 429:
-                    retry_after = response.headers.get("Retry-After")
-                    logger.warning(
-                        f"Rate limited by Spotify. Come back in {retry_after} seconds."
-                    )
-
-                response.raise_for_status()
-                data = response.json()
-                success = True
-                break
-            except Exception as e:
-                last_exception = e
-                backoff_time = sleep_time * (2**attempt)
-                logger.warning(
-                    f"Error getting artist's albums page from Spotify: {e}. Retrying in {backoff_time} seconds."
-                )
-                time.sleep(backoff_time)
-        if not success:
-            logger.error(
-                f"Error getting albums from Spotify for artist {spotify_artist_id}: {last_exception}. Failed after {max_retries} attempts."
+        def fetch_page(offset):
+            return client.get_artist_albums(
+                spotify_artist_id, limit=ALBUMS_PAGE_SIZE, offset=offset
             )
-            raise last_exception
 
-        all_album_items.extend(data.get("items", []))
+        # map keeps the pages in offset order either way.
+        pages = page_executor.map(fetch_page, offsets) if page_executor else map(fetch_page, offsets)
+        for page in pages:
+            all_album_items.extend(page.get("items", []))
 
-        next_url = data.get("next")
-        if not next_url:
-            return all_album_items
-        page_url, page_params = next_url, None
+        return all_album_items
+    except Exception as e:
+        logger.error(
+            f"Error getting albums from Spotify for artist {spotify_artist_id}: {e}"
+        )
+        raise
 
 
-def process_albums_spotify(artist, token):
+def process_albums_spotify(artist, client, page_executor=None):
     """Processes the albums for a given artist from the spotify api"""
     try:
         album_list = []
-        all_album_items = fetch_albums_spotify(artist["spotify_artist_id"], token)
+        all_album_items = fetch_albums_spotify(
+            artist["spotify_artist_id"], client, page_executor
+        )
         for album in all_album_items:
             individual_album = {}
             individual_album["spotify_album_id"] = album["id"]
@@ -98,38 +78,89 @@ def process_albums_spotify(artist, token):
 def dedupe_albums(albums):
     """Deduplicates the albums based on DB existance; primarily for inter group deduplication"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""SELECT spotify_album_id FROM albums""")
-        albums_ids = cursor.fetchall()
-        albums_ids = [album_id[0] for album_id in albums_ids]
-        deduped_albums = [album for album in albums if album["spotify_album_id"] not in albums_ids]
-        return deduped_albums
+        new_album_ids = get_missing_ids(
+            "albums",
+            "spotify_album_id",
+            [album["spotify_album_id"] for album in albums],
+        )
+        return [album for album in albums if album["spotify_album_id"] in new_album_ids]
     except Exception as e:
         logger.error(f"Error deduplicating albums: {e}")
         raise
 
-def write_albums_gcs(artists, bucket_name, base_blob_name):
-    """Writes the albums to the gcs bucket"""
+
+def claim_batch_albums(artists_albums):
+    """Drops albums already in the DB and gives each album shared by several artists of the batch
+    to the first artist listing it, so every album is hydrated and written once per batch"""
     try:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        token = get_spotify_access_token(args.num)
-        for artist in tqdm(artists):
-            blob = bucket.blob(f"{artist['full_blob_name']}/albums.json")
-            albums = process_albums_spotify(artist, token)
-            albums = dedupe_albums(albums)
-            if albums:
-                blob.upload_from_string(
-                    json.dumps(albums, indent=3, ensure_ascii=False),
-                    content_type="application/json",
-                )
-                time.sleep(0.5)
-                logger.info(
-                    f"Successfully wrote {len(albums)} albums for {artist['artist']} to gcs bucket {bucket_name} with blob name {artist['full_blob_name']}/albums.json"
+        candidate_albums = {}
+        for albums in artists_albums:
+            for album in albums:
+                candidate_albums.setdefault(album["spotify_album_id"], album)
+        new_album_ids = {
+            album["spotify_album_id"]
+            for album in dedupe_albums(list(candidate_albums.values()))
+        }
+
+        claimed_album_ids = set()
+        claimed_artists_albums = []
+        for albums in artists_albums:
+            claimed_albums = []
+            for album in albums:
+                album_id = album["spotify_album_id"]
+                if album_id in new_album_ids and album_id not in claimed_album_ids:
+                    claimed_album_ids.add(album_id)
+                    claimed_albums.append(album)
+            claimed_artists_albums.append(claimed_albums)
+
+        listed_count = sum(len(albums) for albums in artists_albums)
+        logger.info(
+            f"Albums stats: {listed_count} listed, {len(candidate_albums)} unique, {len(candidate_albums) - len(new_album_ids)} already in the database, {len(claimed_album_ids)} claimed."
+        )
+        return claimed_artists_albums
+    except Exception as e:
+        logger.error(f"Error claiming batch albums: {e}")
+        raise
+
+
+def write_artist_albums_gcs(artist, albums, bucket_name, uploads):
+    """Queues the claimed albums of one artist for upload"""
+    if albums:
+        uploads.put_json(bucket_name, f"{artist['full_blob_name']}/albums.json", albums)
+        logger.info(
+            f"Queued {len(albums)} albums for {artist['artist']} to gcs bucket {bucket_name} with blob name {artist['full_blob_name']}/albums.json"
+        )
+    else:
+        logger.info(f"All albums for {artist['artist']} already exist in the database or were claimed by another artist of the batch.")
+
+
+def write_albums_gcs(artists, bucket_name, base_blob_name, spotify_client, max_workers=8):
+    """Lists the albums of every artist, up to max_workers artists at once, dedupes them batch-wide
+    and writes them to the gcs bucket. Every request still goes through the shared client, so the
+    rate limit bounds the throughput."""
+    try:
+        # Pages get their own pool so artist tasks never wait on pages queued behind other artists.
+        with ThreadPoolExecutor(max_workers=max_workers) as artist_executor, ThreadPoolExecutor(
+            max_workers=max_workers
+        ) as page_executor:
+            artists_albums = list(
+                tqdm(
+                    artist_executor.map(
+                        lambda artist: process_albums_spotify(
+                            artist, spotify_client, page_executor
+                        ),
+                        artists,
+                    ),
+                    total=len(artists),
                 )
-            else:
-                logger.info(f"All albums for {artist['origination_artist_id']} already exist in the database.")
+            )
+        spotify_client.log_call_counts()
+
+        artists_albums = claim_batch_albums(artists_albums)
+        with UploadQueue() as uploads:
+            uploads.load_hashes(bucket_name, base_blob_name)
+            for artist, albums in zip(artists, artists_albums):
+                write_artist_albums_gcs(artist, albums, bucket_name, uploads)
         logger.info(
             f"Successfully wrote albums for {len(artists)} artists to gcs bucket {bucket_name} with base blob name {base_blob_name}"
         )
@@ -144,10 +175,22 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--page_number", type=int, default=1)
     parser.add_argument( "--batch_number", type=int, default=1)
-    parser.add_argument("--num", type=int, default=1)
+    parser.add_argument(
+        "--num",
+        type=int,
+        default=None,
+        help="Pin a single Spotify credential, by default every configured credential is used",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="Number of artists (and album pages) fetched concurrently, 1 runs sequentially",
+    )
     args = parser.parse_args()
     
     try:
+        client = get_spotify_client(args.num)
         artists = get_artists_from_gcs(
             BUCKET_NAME,
             f"raw-json-data/artists_kworbpage{args.page_number}/batch{args.batch_number}/artists.json",
@@ -157,6 +200,8 @@ if __name__ == "__main__":
             artists,
             BUCKET_NAME,
             f"raw-json-data/artists_kworbpage{args.page_number}/batch{args.batch_number}",
+            client,
+            max_workers=args.workers,
         )
     except Exception as e:
         logger.error(f"Error running the script get_albums.py: {e}")
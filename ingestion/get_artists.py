@@ -2,15 +2,13 @@ import requests
 from bs4 import BeautifulSoup
 from tqdm import tqdm
 from datetime import datetime
-import json
-import time
 import logging
-from google.cloud import storage
 import argparse
 import psycopg2
-from db.db import get_connection
+from db.db import get_missing_ids
 
-from auth import get_spotify_access_token
+from ingestion.spotify_client import get_spotify_client
+from ingestion.storage import get_storage
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s"
@@ -96,49 +94,24 @@ def process_kworb_html(page_number):
         raise
 
 
-def fetch_artists_spotify(batch_artist_list, token, max_retries=2, sleep_time=1):
+def fetch_artists_spotify(batch_artist_list, client):
     """Gets batch of artists from the spotify api"""
-    last_exception = None
-    for attempt in range(max_retries):
-        try:
-            headers = {"Authorization": f"Bearer {token}"}
-            url = "https://api.spotify.com/v1/artists"
-
-            spotify_artist_ids = [
-                artist["spotify_artist_id"] for artist in batch_artist_list
-            ]
-            spotify_artist_ids_str = ",".join(spotify_artist_ids)
-            params = {"ids": spotify_artist_ids_str}
-
-            response = requests.get(url, headers=headers, params=params, timeout=10)
-
-            if response.status_code == 429:
-                retry_after = response.headers.get("Retry-After")
-                logger.warning(
-                    f"Rate limited by Spotify. Come back in {retry_after} seconds."
-                )
-
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            last_exception = e
-            backoff_time = sleep_time * (2**attempt)
-            logger.warning(
-                f"Error getting artists from spotify api: {e}. Retrying in {backoff_time} seconds."
-            )
-            time.sleep(backoff_time)
-    logger.error(
-        f"Error fetching artists from spotify api: {last_exception}. Failed after {max_retries} attempts."
-    )
-    raise last_exception
+    try:
+        spotify_artist_ids = [
+            artist["spotify_artist_id"] for artist in batch_artist_list
+        ]
+        return client.get_artists(spotify_artist_ids)
+    except Exception as e:
+        logger.error(f"Error fetching artists from spotify api: {e}")
+        raise
 
 
-def process_artists_spotify(artists, token, batch_size=50):
+def process_artists_spotify(artists, client, batch_size=50):
     """Processes the spotify response for batches of artists"""
     try:
         for i in tqdm(range(0, len(artists), batch_size)):
             batch_artist_list = artists[i : i + batch_size]
-            response = fetch_artists_spotify(batch_artist_list, token)
+            response = fetch_artists_spotify(batch_artist_list, client)
             for index, artist in enumerate(batch_artist_list):
                 artist["followers"] = int(
                     response["artists"][index]["followers"]["total"]
@@ -146,7 +119,6 @@ def process_artists_spotify(artists, token, batch_size=50):
                 artist["images"] = [
                     image["url"] for image in response["artists"][index]["images"]
                 ]
-            time.sleep(1)
         return artists
     except Exception as e:
         logger.error(f"Error processing spotify response: {e}")
@@ -155,16 +127,12 @@ def process_artists_spotify(artists, token, batch_size=50):
 def dedupe_artists(artists):
     """Deduplicates the artists based on DB existance; primarily for inter group deduplication"""
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""SELECT spotify_artist_id FROM artists""")
-        artists_ids = cursor.fetchall()
-        artists_ids = [artist_id[0] for artist_id in artists_ids]
-        deduped_artists = [artist for artist in artists if artist["spotify_artist_id"] not in artists_ids]
-
-        cursor.close()
-        conn.close()
-        return deduped_artists
+        new_artist_ids = get_missing_ids(
+            "artists",
+            "spotify_artist_id",
+            [artist["spotify_artist_id"] for artist in artists],
+        )
+        return [artist for artist in artists if artist["spotify_artist_id"] in new_artist_ids]
     except Exception as e:
         logger.error(f"Error deduplicating artists: {e}")
         raise
@@ -173,19 +141,13 @@ def dedupe_artists(artists):
 def write_artists_gcs(artists, bucket_name, blob_name):
     """Writes the artist list to a json file in a gcp bucket"""
     try:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
         artists = dedupe_artists(artists)
         if artists:
             for artist in artists:
                 artist["full_blob_name"] = (
                     f"{blob_name}/{artist['spotify_artist_id']}"
                 )
-            blob = bucket.blob(f"{blob_name}/artists.json")
-            blob.upload_from_string(
-                json.dumps(artists, indent=3, ensure_ascii=False),
-                content_type="application/json",
-            )
+            get_storage().write_json(bucket_name, f"{blob_name}/artists.json", artists)
             logger.info(
                 f"Successfully wrote artists to gcs bucket {bucket_name} with blob name {blob_name}/artists.json"
             )
@@ -202,18 +164,24 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--page_number", type=int, default=1)
     parser.add_argument("--batch_number", type=int, default=1)
-    parser.add_argument("--num", type=int, default=1)
+    parser.add_argument(
+        "--num",
+        type=int,
+        default=None,
+        help="Pin a single Spotify credential, by default every configured credential is used",
+    )
     args = parser.parse_args()
     
     try:
-        token = get_spotify_access_token(args.num)
+        client = get_spotify_client(args.num)
         artists = process_kworb_html(args.page_number)
-        artists = process_artists_spotify(artists, token)
+        artists = process_artists_spotify(artists, client)
         write_artists_gcs(
             artists,
             BUCKET_NAME,
             f"raw-json-data/artists_kworbpage{args.page_number}/batch{args.batch_number}",
         )
+        client.log_call_counts()
     except Exception as e:
         logger.error(f"Error running the script get_artists.py: {e}")
         raise
@@ -5,8 +5,7 @@ from playwright.sync_api import sync_playwright
 from tqdm import tqdm
 from argparse import ArgumentParser
 from ingestion.utils import get_artists_from_gcs
-from google.cloud import storage
-import json
+from ingestion.storage import get_storage
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s"
@@ -96,14 +95,7 @@ def write_genres_to_gcs(artists, bucket_name, base_blob_name):
         browser.close()
         p.stop()
 
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(f"{base_blob_name}/artists.json")
-
-        blob.upload_from_string(
-            json.dumps(updated_artists, indent=3, ensure_ascii=False),
-            content_type="application/json",
-        )
+        get_storage().write_json(bucket_name, f"{base_blob_name}/artists.json", updated_artists)
 
         logger.info(
             f"Wrote {len(updated_artists)} artists to gs://{bucket_name}/{base_blob_name}/artists.json"
@@ -1,16 +1,12 @@
-from google.cloud import storage
-import requests
-import json
 import logging
-import time
 from tqdm import tqdm
 import argparse
 
-from ingestion.utils import (
-    get_artists_from_gcs,
-    get_artist_songs_from_gcs,
-)
-from auth import get_spotify_access_token
+from ingestion.utils import get_artists_from_gcs
+from ingestion.spotify_client import get_spotify_client
+from ingestion.track_store import get_track_store
+from ingestion.upload_queue import UploadQueue
+from ingestion.prefetch import prefetch_artist_blobs
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s"
@@ -52,81 +48,55 @@ def adjust_spotify_popularity_value(popularity):
     return popularity
 
 
-def fetch_songs_spotify(songs, token, max_retries=3, sleep_time=1):
-    """Fetches songs from the spotify api"""
-    last_exception = None
-    for attempt in range(max_retries):
-        try:
-            url = "https://api.spotify.com/v1/tracks"
-            headers = {"Authorization": f"Bearer {token}"}
-            song_ids = ",".join([song["spotify_song_id"] for song in songs])
-            params = {"ids": song_ids}
-            response = requests.get(url, headers=headers, params=params)
-
-            if response.status_code == 429:
-                retry_after = response.headers.get("Retry-After")
-                logger.warning(
-                    f"Rate limited by Spotify. Come back in {retry_after} seconds."
-                )
-
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            last_exception = e
-            backoff_time = sleep_time * (2**attempt)
-            logger.warning(
-                f"Error fetching ISRC from Spotify API: {e}. Retrying in {backoff_time} seconds."
-            )
-            time.sleep(backoff_time)
-
-    logger.error(
-        f"Error fetching ISRC from Spotify API: {last_exception}. Failed after {max_retries} attempts."
-    )
-    raise last_exception
-
-
-def process_songs_spotify(songs, token, batch_size=50):
-    """Processes the songs, specifically the ISRC and popularity, by batch"""
+def fetch_songs_spotify(songs, client, track_store):
+    """Fetches songs from the track store, falling back to the spotify api for missing or stale ones"""
     try:
-        valid_songs = []
-        for i in range(0, len(songs), batch_size):
-            batch_songs = songs[i : i + batch_size]
-            response = fetch_songs_spotify(batch_songs, token)
+        return track_store.get_tracks(
+            client, [song["spotify_song_id"] for song in songs]
+        )
+    except Exception as e:
+        logger.error(f"Error fetching ISRC from Spotify API: {e}")
+        raise
 
-            for index, song in enumerate(batch_songs):
-                track = response["tracks"][index]
-                if not track.get("external_ids"):
-                    continue
 
-                song["isrc"] = track["external_ids"]["isrc"]
-                raw_popularity = track["popularity"]
-                adjusted_popularity = adjust_spotify_popularity_value(raw_popularity)
-                song["spotify_popularity"] = adjusted_popularity
-                valid_songs.append(song)
+def process_songs_spotify(songs, client, track_store=None):
+    """Processes the songs, specifically the ISRC and popularity"""
+    try:
+        track_store = track_store or get_track_store()
+        tracks = fetch_songs_spotify(songs, client, track_store)
 
-            time.sleep(0.8)
+        valid_songs = []
+        for song in songs:
+            track = tracks.get(song["spotify_song_id"])
+            if not track or not track.get("external_ids"):
+                continue
+
+            song["isrc"] = track["external_ids"]["isrc"]
+            raw_popularity = track["popularity"]
+            adjusted_popularity = adjust_spotify_popularity_value(raw_popularity)
+            song["spotify_popularity"] = adjusted_popularity
+            valid_songs.append(song)
         return valid_songs
     except Exception as e:
         logger.error(f"Error processing ISRC from Spotify API: {e}")
         raise
 
 
-def write_isrc_pop_gcs(artists, bucket_name, base_blob_name, token):
+def write_isrc_pop_gcs(artists, bucket_name, base_blob_name, spotify_client):
     """Writes/adds the ISRC and popularity of the songs to the gcs bucket"""
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
     try:
-        for artist in tqdm(artists):
-            songs = get_artist_songs_from_gcs(artist, bucket_name)
-            songs = process_songs_spotify(songs, token)
-            blob = bucket.blob(f"{artist['full_blob_name']}/songs.json")
-            blob.upload_from_string(
-                json.dumps(songs, indent=3, ensure_ascii=False),
-                content_type="application/json",
-            )
-            logger.info(
-                f"Successfully wrote ISRC for artist {artist['artist']} {len(songs)} songs to gcs bucket {bucket_name} with blob name {artist['full_blob_name']}/songs.json"
-            )
+        artists_songs = prefetch_artist_blobs(artists, bucket_name, ["songs.json"])
+        with UploadQueue() as uploads:
+            uploads.load_hashes(bucket_name, base_blob_name)
+            for artist, payloads in tqdm(artists_songs, total=len(artists)):
+                if "songs.json" not in payloads:
+                    logger.info(f"No songs for artist {artist['artist']}, skipping ISRC and popularity.")
+                    continue
+                songs = process_songs_spotify(payloads["songs.json"], spotify_client)
+                uploads.put_json(bucket_name, f"{artist['full_blob_name']}/songs.json", songs)
+                logger.info(
+                    f"Queued ISRC for artist {artist['artist']} {len(songs)} songs to gcs bucket {bucket_name} with blob name {artist['full_blob_name']}/songs.json"
+                )
 
         logger.info(
             f"Successfully wrote ISRC for {len(artists)} artists songs to gcs bucket {bucket_name} with blob name {base_blob_name}"
@@ -142,11 +112,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--page_number", type=int, default=1)
     parser.add_argument("--batch_number", type=int, default=1)
-    parser.add_argument("--num", type=int, default=3)
+    parser.add_argument(
+        "--num",
+        type=int,
+        default=None,
+        help="Pin a single Spotify credential, by default every configured credential is used",
+    )
     args = parser.parse_args()
 
     try:
-        token = get_spotify_access_token(args.num)
+        client = get_spotify_client(args.num)
         artists = get_artists_from_gcs(
             BUCKET_NAME,
             f"raw-json-data/artists_kworbpage{args.page_number}/batch{args.batch_number}/artists.json",
@@ -155,8 +130,10 @@ if __name__ == "__main__":
             artists,
             BUCKET_NAME,
             f"raw-json-data/artists_kworbpage{args.page_number}/batch{args.batch_number}",
-            token,
+            client,
         )
+        client.log_call_counts()
+        get_track_store().log_stats()
     except Exception as e:
         logger.error(f"Error running the script get_isrc.py: {e}")
         raise
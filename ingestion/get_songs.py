@@ -1,18 +1,17 @@
-from google.cloud import storage
-import requests
-import json
 import logging
-import time
 from tqdm import tqdm
 import argparse
 
 from ingestion.utils import (
     get_artists_from_gcs,
-    get_albums_from_gcs,
     get_artist_songs_from_gcs,
     normalize_release_date,
 )
-from auth import get_spotify_access_token
+from ingestion.spotify_client import get_spotify_client
+from ingestion.track_store import get_track_store
+from ingestion.upload_queue import UploadQueue
+from ingestion.prefetch import prefetch_artist_blobs
+from ingestion.album_songs import ALBUM_SONGS_FILE, group_songs_by_album, put_album_songs
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s"
@@ -20,6 +19,9 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 BUCKET_NAME = "music--data"
+# The several-albums endpoint accepts at most 20 ids and embeds up to 50 tracks per album.
+ALBUMS_BATCH_SIZE = 20
+ALBUM_TRACKS_PAGE_SIZE = 50
 SKIT_WORDS = [
     "skit",
     "outro",
@@ -32,73 +34,46 @@ SKIT_WORDS = [
 ]
 
 
-def fetch_album_songs_spotify(album_id, token, max_retries=2, sleep_time=1):
-    """Gets the songs of an album from the spotify api"""
-    last_exception = None
-    for attempt in range(max_retries):
-        try:
-            url = f"https://api.spotify.com/v1/albums/{album_id}/tracks"
-            headers = {"Authorization": f"Bearer {token}"}
-            params = {"limit": 50}
-            response = requests.get(url, headers=headers, params=params, timeout=10)
-
-            if response.status_code == 429:
-                retry_after = response.headers.get("Retry-After")
-                logger.warning(
-                    f"Rate limited by Spotify. Come back in {retry_after} seconds."
+def fetch_albums_songs_spotify(album_ids, client):
+    """Gets the full track lists of up to 20 albums from the spotify api. The tracks embedded in
+    the several-albums response cover most albums, only larger ones page through the rest."""
+    try:
+        albums_tracks = {}
+        response = client.get_albums(album_ids)
+        for album in response["albums"]:
+            if not album:
+                continue
+            tracks = album["tracks"]
+            items = list(tracks["items"])
+            for offset in range(len(items), tracks["total"], ALBUM_TRACKS_PAGE_SIZE):
+                page = client.get_album_tracks(
+                    album["id"], limit=ALBUM_TRACKS_PAGE_SIZE, offset=offset
                 )
+                items.extend(page["items"])
+            albums_tracks[album["id"]] = items
+        return albums_tracks
+    except Exception as e:
+        logger.error(f"Error getting album songs from spotify: {e}")
+        raise
 
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            last_exception = e
-            backoff_time = sleep_time * (2**attempt)
-            logger.warning(
-                f"Error getting album songs from spotify: {e}. Retrying in {backoff_time} seconds."
-            )
-            time.sleep(backoff_time)
-    logger.error(
-        f"Error getting album songs from spotify: {last_exception}. Failed after {max_retries} attempts."
-    )
-    raise last_exception
-
-
-def fetch_top_tracks_spotify(artist_id, token, max_retries=2, sleep_time=1):
-    """Gets the top tracks of an artist from the spotify api"""
-    last_exception = None
-    for attempt in range(max_retries):
-        try:
-            url = f"https://api.spotify.com/v1/artists/{artist_id}/top-tracks"
-            headers = {"Authorization": f"Bearer {token}"}
-            response = requests.get(url, headers=headers, timeout=10)
-
-            if response.status_code == 429:
-                retry_after = response.headers.get("Retry-After")
-                logger.warning(
-                    f"Rate limited by Spotify. Come back in {retry_after} seconds."
-                )
 
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            last_exception = e
-            backoff_time = sleep_time * (2**attempt)
-            logger.warning(
-                f"Error getting artist top tracks from spotify: {e}. Retrying in {backoff_time} seconds."
-            )
-            time.sleep(backoff_time)
-    logger.error(
-        f"Error getting artist top tracks from spotify: {last_exception}. Failed after {max_retries} attempts."
-    )
-    raise last_exception
+def fetch_top_tracks_spotify(artist_id, client):
+    """Gets the top tracks of an artist from the spotify api. They are full track objects,
+    so they are kept in the track store for the ISRC/popularity stage."""
+    try:
+        top_tracks = client.get_artist_top_tracks(artist_id)
+        get_track_store().put_many(top_tracks["tracks"])
+        return top_tracks
+    except Exception as e:
+        logger.error(f"Error getting artist top tracks from spotify: {e}")
+        raise
 
 
-def process_album_songs_spotify(album, token, duration_threshold=50000):
+def process_album_songs_spotify(album, tracks, duration_threshold=50000):
     """Processes the songs from the spotify api for a given album"""
     try:
         songs_list = []
-        songs = fetch_album_songs_spotify(album["spotify_album_id"], token)
-        for song in songs["items"]:
+        for song in tracks:
             normalized_song_name = (song["name"]).lower()
             if any(word in normalized_song_name for word in SKIT_WORDS):
                 if song["duration_ms"] < duration_threshold:
@@ -126,11 +101,11 @@ def process_album_songs_spotify(album, token, duration_threshold=50000):
         raise
 
 
-def process_top_tracks_spotify(artist, token, top_n_tracks=15):
+def process_top_tracks_spotify(artist, client, top_n_tracks=15):
     """Processes the top tracks from the spotify api for a given artist, only includes singles"""
     try:
         top_songs = []
-        top_tracks = fetch_top_tracks_spotify(artist["spotify_artist_id"], token)
+        top_tracks = fetch_top_tracks_spotify(artist["spotify_artist_id"], client)
         for track in top_tracks["tracks"][:top_n_tracks]:
             individual_song = {}
             individual_song["spotify_song_id"] = track["id"]
@@ -157,13 +132,34 @@ def process_top_tracks_spotify(artist, token, top_n_tracks=15):
         raise
 
 
-def dedupe_single_songs(artist, bucket_name, token):
+def process_artist_album_songs(albums, spotify_client):
+    """Gets the songs of an artist's full albums, 20 albums per request. Returns {album id: songs}"""
+    try:
+        full_albums = [album for album in albums if album["album_type"] == "album"]
+        album_songs = {}
+        for i in range(0, len(full_albums), ALBUMS_BATCH_SIZE):
+            batch_albums = full_albums[i : i + ALBUMS_BATCH_SIZE]
+            albums_tracks = fetch_albums_songs_spotify(
+                [album["spotify_album_id"] for album in batch_albums], spotify_client
+            )
+            for album in batch_albums:
+                album_songs[album["spotify_album_id"]] = process_album_songs_spotify(
+                    album, albums_tracks.get(album["spotify_album_id"], [])
+                )
+        return album_songs
+    except Exception as e:
+        logger.error(f"Error processing album songs: {e}")
+        raise
+
+
+def dedupe_single_songs(artist, bucket_name, client, all_album_songs=None):
     """Dedupe the songs. This removes songs that are already in the albums, and leaves singles
     in the top 15 songs of the artist."""
     try:
         deduped_songs = []
-        top_songs = process_top_tracks_spotify(artist, token)
-        all_album_songs = get_artist_songs_from_gcs(artist, bucket_name)
+        top_songs = process_top_tracks_spotify(artist, client)
+        if all_album_songs is None:
+            all_album_songs = get_artist_songs_from_gcs(artist, bucket_name)
         for song in top_songs:
             if song["spotify_song_id"] not in [
                 song["spotify_song_id"] for song in all_album_songs
@@ -178,37 +174,25 @@ def dedupe_single_songs(artist, bucket_name, token):
         raise
 
 
-def write_album_songs_gcs(artists, bucket_name, base_blob_name, token):
-    """Writes the songs from an album for an aritst inside the album's folder"""
+def write_album_songs_gcs(artists, bucket_name, base_blob_name, spotify_client):
+    """Writes the songs of an artist's albums to its album songs container and songs.json"""
     try:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        for artist in tqdm(artists):
-            albums = get_albums_from_gcs(artist, bucket_name)
-            all_album_songs = []
-            for album in albums:
-                if album["album_type"] == "album":
-                    blob = bucket.blob(
-                        f"{artist['full_blob_name']}/{album['spotify_album_id']}/songs.json"
-                    )
-                    songs = process_album_songs_spotify(album, token)
-                    blob.upload_from_string(
-                        json.dumps(songs, indent=3, ensure_ascii=False),
-                        content_type="application/json",
-                    )
-                    all_album_songs.extend(songs)
-                    time.sleep(0.5)
-            logger.info(
-                f"Successfully wrote albums' songs for {len(albums)} albums for artist {artist['artist']} to gcs bucket {bucket_name} with blob name {artist['full_blob_name']} and seperate folders for each album."
-            )
-            blob = bucket.blob(f"{artist['full_blob_name']}/songs.json")
-            blob.upload_from_string(
-                json.dumps(all_album_songs, indent=3, ensure_ascii=False),
-                content_type="application/json",
-            )
-            logger.info(
-                f"Successfully wrote {len(all_album_songs)} albums' songs for {artist['artist']} to gcs bucket {bucket_name} with blob name {artist['full_blob_name']}/songs.json"
-            )
+        artists_albums = prefetch_artist_blobs(artists, bucket_name, ["albums.json"])
+        with UploadQueue() as uploads:
+            uploads.load_hashes(bucket_name, base_blob_name)
+            for artist, payloads in tqdm(artists_albums, total=len(artists)):
+                # Artists whose albums were all known already have no albums.json.
+                albums = payloads.get("albums.json", [])
+                album_songs = process_artist_album_songs(albums, spotify_client)
+                all_album_songs = [song for album in album_songs.values() for song in album]
+                put_album_songs(uploads, artist, bucket_name, album_songs)
+                logger.info(
+                    f"Queued albums' songs for {len(album_songs)} albums for artist {artist['artist']} to gcs bucket {bucket_name} with blob name {artist['full_blob_name']}/{ALBUM_SONGS_FILE}"
+                )
+                uploads.put_json(bucket_name, f"{artist['full_blob_name']}/songs.json", all_album_songs)
+                logger.info(
+                    f"Queued {len(all_album_songs)} albums' songs for {artist['artist']} to gcs bucket {bucket_name} with blob name {artist['full_blob_name']}/songs.json"
+                )
         logger.info(
             f"Successfully wrote albums' songs for {len(artists)} artists to gcs bucket {bucket_name} with blob name {base_blob_name}."
         )
@@ -219,36 +203,26 @@ def write_album_songs_gcs(artists, bucket_name, base_blob_name, token):
         raise
 
 
-def write_single_songs_gcs(artists, bucket_name, base_blob_name, token):
-    """Writes the single songs to the album's folder"""
+def write_single_songs_gcs(artists, bucket_name, base_blob_name, spotify_client):
+    """Adds the single songs to the artist's album songs container and songs.json"""
     try:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-
-        for artist in tqdm(artists):
-            single_songs = dedupe_single_songs(artist, bucket_name, token)
-            for song in single_songs:
-                blob = bucket.blob(
-                    f"{artist['full_blob_name']}/{song['spotify_album_id']}/songs.json"
+        artists_songs = prefetch_artist_blobs(artists, bucket_name, ["songs.json"])
+        with UploadQueue() as uploads:
+            uploads.load_hashes(bucket_name, base_blob_name)
+            for artist, payloads in tqdm(artists_songs, total=len(artists)):
+                existing_songs = payloads.get("songs.json", [])
+                single_songs = dedupe_single_songs(artist, bucket_name, spotify_client, existing_songs)
+                existing_songs.extend(single_songs)
+                # songs.json already holds every album's songs, so the container is rebuilt from it
+                # rather than read back.
+                put_album_songs(uploads, artist, bucket_name, group_songs_by_album(existing_songs))
+                logger.info(
+                    f"Queued {len(single_songs)} single songs for artist {artist['artist']} to gcs bucket {bucket_name} with blob name {artist['full_blob_name']}/{ALBUM_SONGS_FILE}"
                 )
-                blob.upload_from_string(
-                    json.dumps(single_songs, indent=3, ensure_ascii=False),
-                    content_type="application/json",
+                uploads.put_json(bucket_name, f"{artist['full_blob_name']}/songs.json", existing_songs)
+                logger.info(
+                    f"Queued {len(single_songs)} single songs added to {len(existing_songs)} existing songs for artist {artist['artist']}"
                 )
-            logger.info(
-                f"Successfully wrote {len(single_songs)} single songs for artist {artist['artist']} to gcs bucket {bucket_name} with blob name {artist['full_blob_name']} and seperate folders for each single."
-            )
-            blob = bucket.blob(f"{artist['full_blob_name']}/songs.json")
-            existing_songs = json.loads(blob.download_as_string())
-            existing_songs.extend(single_songs)
-            blob.upload_from_string(
-                json.dumps(existing_songs, indent=3, ensure_ascii=False),
-                content_type="application/json",
-            )
-            logger.info(
-                f"Successfully added {len(single_songs)} single songs to {len(existing_songs)} existing songs for artist {artist['artist']}"
-            )
-            time.sleep(0.5)
         logger.info(
             f"Successfully wrote single songs for {len(artists)} artists to gcs bucket {bucket_name} with blob name {base_blob_name}"
         )
@@ -263,11 +237,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--page_number", type=int, default=1)
     parser.add_argument("--batch_number", type=int, default=1)
-    parser.add_argument("--num", type=int, default=2)
+    parser.add_argument(
+        "--num",
+        type=int,
+        default=None,
+        help="Pin a single Spotify credential, by default every configured credential is used",
+    )
     args = parser.parse_args()
     
     try:
-        token = get_spotify_access_token(args.num)
+        client = get_spotify_client(args.num)
         artists = get_artists_from_gcs(
             BUCKET_NAME,
             f"raw-json-data/artists_kworbpage{args.page_number}/batch{args.batch_number}/artists.json",
@@ -277,14 +256,15 @@ if __name__ == "__main__":
             artists,
             BUCKET_NAME,
             f"raw-json-data/artists_kworbpage{args.page_number}/batch{args.batch_number}",
-            token,
+            client,
         )
         write_single_songs_gcs(
             artists,
             BUCKET_NAME,
             f"raw-json-data/artists_kworbpage{args.page_number}/batch{args.batch_number}",
-            token,
+            client,
         )
+        client.log_call_counts()
     except Exception as e:
         logger.error(f"Error running the script get_songs.py: {e}")
         raise
@@ -1,19 +1,18 @@
 import requests
 from bs4 import BeautifulSoup
 from tqdm import tqdm
-import json
 import logging
-from google.cloud import storage
 import argparse
 import time
 
 from ingestion.utils import (
     get_artists_from_gcs,
-    get_artist_songs_from_gcs,
-    get_artist_grouped_songs_from_gcs,
     normalize_release_date,
 )
-from auth import get_spotify_access_token
+from ingestion.spotify_client import get_spotify_client
+from ingestion.track_store import get_track_store
+from ingestion.upload_queue import UploadQueue
+from ingestion.prefetch import prefetch_artist_blobs
 from ingestion.group_songs import group_songs
 
 logging.basicConfig(
@@ -123,50 +122,15 @@ def collect_missing_ids(grouped_songs, kworb_songs):
         raise
 
 
-def fetch_tracks_from_spotify(track_ids, token, max_retries=3, sleep_time=1):
-    """Fetches tracks from Spotify API in batches of 50, by batch"""
+def fetch_tracks_from_spotify(track_ids, client, track_store=None):
+    """Fetches tracks from the track store, falling back to the Spotify API in batches of 50"""
     try:
-        all_tracks = []
-        last_exception = None
-        for i in range(0, len(track_ids), 50):
-            batch = track_ids[i : i + 50]
-            ids_str = ",".join(batch)
-
-            for attempt in range(max_retries):
-                try:
-                    url = f"https://api.spotify.com/v1/tracks?ids={ids_str}"
-                    headers = {"Authorization": f"Bearer {token}"}
-                    response = requests.get(url, headers=headers, timeout=10)
-
-                    if response.status_code == 429:
-                        retry_after = response.headers.get("Retry-After")
-                        logger.warning(
-                            f"Rate limited by Spotify. Come back in {retry_after} seconds."
-                        )
-
-                    response.raise_for_status()
-                    data = response.json()
-
-                    for track in data["tracks"]:
-                        if track:
-                            all_tracks.append(track)
-
-                    time.sleep(0.1)
-                    break
-                except Exception as e:
-                    last_exception = e
-                    backoff_time = sleep_time * (2**attempt)
-                    logger.warning(
-                        f"Error fetching tracks batch: {e}. Retrying in {backoff_time} seconds."
-                    )
-                    time.sleep(backoff_time)
-
-        return all_tracks
+        track_store = track_store or get_track_store()
+        tracks = track_store.get_tracks(client, track_ids)
+        return [tracks[track_id] for track_id in track_ids if track_id in tracks]
     except Exception as e:
-        logger.error(
-            f"Error fetching tracks from Spotify: {last_exception}. Failed after {max_retries} attempts."
-        )
-        raise last_exception
+        logger.error(f"Error fetching tracks from Spotify: {e}")
+        raise
 
 
 def process_backfilled_tracks(tracks, artist):
@@ -223,58 +187,69 @@ def update_songs_from_grouped(songs, grouped_songs):
         raise
 
 
-def write_streams_to_gcs(artists, bucket_name, base_blob_name):
-    """Main pipeline: matches streams, backfills missing tracks, writes songs.json and grouped_songs.json"""
+def process_artist_streams(artist, songs, grouped_songs, bucket_name, spotify_client):
+    """Matches kworb streams to an artist's songs, backfilling and regrouping tracks that are on kworb
+    but missing from the songs. Returns the updated (songs, grouped_songs)"""
     try:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        token = get_spotify_access_token(args.num)
+        kworb_songs = process_artist_songs_kworb(artist)
+        missing_ids = collect_missing_ids(grouped_songs, kworb_songs)
 
-        for artist in tqdm(artists):
-            try:
-                songs = get_artist_songs_from_gcs(artist, bucket_name)
-                kworb_songs = process_artist_songs_kworb(artist)
-                grouped_songs = get_artist_grouped_songs_from_gcs(artist, bucket_name)
+        if missing_ids:
+            fetched_tracks = fetch_tracks_from_spotify(missing_ids, spotify_client)
+            backfilled_songs = process_backfilled_tracks(fetched_tracks, artist)
+            songs.extend(backfilled_songs)
 
-                missing_ids = collect_missing_ids(grouped_songs, kworb_songs)
+            logger.info(
+                f"Added {len(backfilled_songs)} backfilled tracks for {artist['artist']}"
+            )
 
-                if missing_ids:
-                    fetched_tracks = fetch_tracks_from_spotify(missing_ids, token)
-                    backfilled_songs = process_backfilled_tracks(fetched_tracks, artist)
-                    songs.extend(backfilled_songs)
+            grouped_songs = group_songs(artist, bucket_name, songs)
+        else:
+            logger.info(f"No missing IDs found for {artist['artist']}")
 
-                    logger.info(
-                        f"Added {len(backfilled_songs)} backfilled tracks for {artist['artist']}"
-                    )
+        grouped_songs = match_streams_to_grouped_songs(
+            grouped_songs, kworb_songs
+        )
 
-                    grouped_songs = group_songs(artist, bucket_name, songs)
-                else:
-                    logger.info(f"No missing IDs found for {artist['artist']}")
+        songs = update_songs_from_grouped(songs, grouped_songs)
+        return songs, grouped_songs
+    except Exception as e:
+        logger.error(f"Error processing streams for artist {artist['artist']}: {e}")
+        raise
 
-                grouped_songs = match_streams_to_grouped_songs(
-                    grouped_songs, kworb_songs
-                )
 
-                songs = update_songs_from_grouped(songs, grouped_songs)
+def write_streams_to_gcs(artists, bucket_name, base_blob_name, spotify_client):
+    """Main pipeline: matches streams, backfills missing tracks, writes songs.json and grouped_songs.json"""
+    try:
+        artists_blobs = prefetch_artist_blobs(artists, bucket_name, ["songs.json", "grouped_songs.json"])
+        with UploadQueue() as uploads:
+            uploads.load_hashes(bucket_name, base_blob_name)
+            for artist, payloads in tqdm(artists_blobs, total=len(artists)):
+                try:
+                    if "songs.json" not in payloads:
+                        logger.info(f"No songs for artist {artist['artist']}, skipping streams.")
+                        continue
+                    songs, grouped_songs = process_artist_streams(
+                        artist,
+                        payloads["songs.json"],
+                        payloads.get("grouped_songs.json", {}),
+                        bucket_name,
+                        spotify_client,
+                    )
 
-                blob = bucket.blob(f"{artist['full_blob_name']}/songs.json")
-                blob.upload_from_string(
-                    json.dumps(songs, indent=3, ensure_ascii=False),
-                    content_type="application/json",
-                )
+                    uploads.put_json(bucket_name, f"{artist['full_blob_name']}/songs.json", songs)
 
-                blob = bucket.blob(f"{artist['full_blob_name']}/grouped_songs.json")
-                blob.upload_from_string(
-                    json.dumps(grouped_songs, indent=3, ensure_ascii=False),
-                    content_type="application/json",
-                )
+                    uploads.put_json(bucket_name, f"{artist['full_blob_name']}/grouped_songs.json", grouped_songs)
 
-                time.sleep(0.5)
+                    # Paces the kworb scraping, Spotify calls are paced by the client's rate limiter.
+                    time.sleep(0.5)
 
-            except Exception as e:
-                logger.error(f"Error processing artist {artist['artist']}: {e}")
-                continue
+                except Exception as e:
+                    logger.error(f"Error processing artist {artist['artist']}: {e}")
+                    continue
 
+        spotify_client.log_call_counts()
+        get_track_store().log_stats()
         logger.info(
             f"Successfully wrote streams for {len(artists)} artists to gcs bucket {bucket_name} with base blob name {base_blob_name}"
         )
@@ -289,10 +264,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--page_number", type=int, default=1)
     parser.add_argument("--batch_number", type=int, default=1)
-    parser.add_argument("--num", type=int, default=1)
+    parser.add_argument(
+        "--num",
+        type=int,
+        default=None,
+        help="Pin a single Spotify credential, by default every configured credential is used",
+    )
     args = parser.parse_args()
 
     try:
+        client = get_spotify_client(args.num)
         artists = get_artists_from_gcs(
             BUCKET_NAME,
             f"raw-json-data/artists_kworbpage{args.page_number}/batch{args.batch_number}/artists.json",
@@ -302,6 +283,7 @@ if __name__ == "__main__":
             artists,
             BUCKET_NAME,
             f"raw-json-data/artists_kworbpage{args.page_number}/batch{args.batch_number}",
+            client,
         )
     except Exception as e:
         logger.error(f"Error running the script get_streams.py: {e}")
@@ -1,13 +1,13 @@
-from google.cloud import storage
-import json
 import logging
 from tqdm import tqdm
 import argparse
-import re
-import unicodedata
-import string
+import bisect
+from typing import NamedTuple
 
 from ingestion.utils import get_artists_from_gcs, get_artist_songs_from_gcs
+from ingestion.normalizer import normalize_song_name
+from ingestion.upload_queue import UploadQueue
+from ingestion.prefetch import prefetch_artist_blobs
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s"
@@ -16,193 +16,82 @@ logger = logging.getLogger(__name__)
 
 BUCKET_NAME = "music--data"
 
-# Versions that are truly different recordings/performances
-DISTINCT_VERSIONS = {
-    "live",
-    "acoustic",
-    "remix",
-    "mix",
-    "edit",
-    "instrumental",
-    "karaoke",
-    "demo",
-    "outtake",
-    "reprise",
-    "cover",
-    "unplugged",
-    "orchestral",
-    "cappella",
-    "acapella",
-    "stripped",
-    "strings",
-    "session",
-    "rehearsal",
-    "bootleg",
-    "alternate",
-}
 
-# Versions that are the same recording, just repackaged
-SAME_RECORDING = {
-    "remastered",
-    "remaster",
-    "remastering",
-    "deluxe",
-    "explicit",
-    "clean",
-    "album",
-    "version",
-    "single",
-    "original",
-    "standard",
-    "film",
-    "edition",
-    "anniversary",
-    "expanded",
-    "extended",
-    "bonus",
-    "special",
-    "collectors",
-    "collector",
-    "limited",
-    "radio",
-    "digital",
-    "vinyl",
-    "cd",
-    "stereo",
-    "mono",
-}
+class SongRecord(NamedTuple):
+    """Compact form of a grouped song variant, the fields in the order they are serialized"""
 
+    artists: list
+    artist_ids: list
+    spotify_song_id: str
+    song: str
+    duration_ms: int
+    album: str
+    spotify_popularity: int
+    isrc: str
 
-def normalize_song_name(title: str) -> str:
-    """
-    Normalize Spotify track names for grouping.
-    
-    Examples:
-        'Supersonic - Remastered' -> 'supersonic'
-        'Wonderwall (Live at Wembley)' -> 'wonderwall live'
-        'Champagne Supernova - Deluxe Edition' -> 'champagne supernova'
-    """
-    if not title:
-        return ""
-    
-    original_title = title
-    
-    title = unicodedata.normalize("NFKD", title).casefold()
-    
-    feat_patterns = [
-        r'\s*[\(\[\{]\s*feat\.?[^\)\]\}]*[\)\]\}]',  # (feat. X)
-        r'\s*[\(\[\{]\s*ft\.?[^\)\]\}]*[\)\]\}]',     # (ft. X)
-        r'\s*[\(\[\{]\s*featuring[^\)\]\}]*[\)\]\}]', # (featuring X)
-        r'\s*-\s*feat\.?.*$',                          # - feat. X
-        r'\s*-\s*ft\.?.*$',                            # - ft. X
-        r'\s*-\s*featuring.*$',                        # - featuring X
-    ]
-    
-    for pattern in feat_patterns:
-        title = re.sub(pattern, '', title, flags=re.IGNORECASE)
 
-    title = re.sub(r'\s*[\(\[\{]\s*\d{4}\s*[\)\]\}]', '', title)
-    # Remove standalone 4-digit years starting with 10..20 (e.g., 1995, 2011) anywhere in the title
-    title = re.sub(r'\b(1[0-9]{3}|20[0-9]{2})\b', '', title)
-    
-    title = title.translate(str.maketrans('', '', string.punctuation))
-    
-    title = re.sub(r'\s+', ' ', title).strip()
-    
-    words = title.split()
-    
-    if not words:
-        return original_title.lower()
-    
-    filtered_words = []
-    for word in words:
-        if word in DISTINCT_VERSIONS:
-            filtered_words.append(word)
-        elif word not in SAME_RECORDING:
-            filtered_words.append(word)
-    
-    result = ' '.join(filtered_words).strip()
-    
-    return result if result else original_title.lower()
+def variant_key(normalized_name, variant_number):
+    """The grouped_songs key of a title's nth duration variant"""
+    return normalized_name if variant_number == 1 else f"{normalized_name}_variant{variant_number}"
 
 
 def group_songs(artist, bucket_name, songs=None, threshold=20000):
-    """Group a given artist's songs into variants by normalized name and duration proximity."""
-    try: 
-        grouped_songs = {}
+    """Group a given artist's songs into variants by normalized name and duration proximity.
+
+    A song joins the lowest numbered variant of its title holding a song less than threshold ms
+    away, found by bisecting a per-title sorted duration index, or opens a new variant. A song
+    whose ISRC was already seen is the same recording and joins that song's group directly.
+    """
+    try:
+        groups = {}
         variant_counter = {}
-        
+        # normalized name -> (sorted durations, variant number of each duration)
+        duration_index = {}
+        isrc_index = {}
+
         # There are cases in the repo where songs can be passed in from memory/other functions, if not we get them from GCS
         if songs is None:
             songs = get_artist_songs_from_gcs(artist, bucket_name)
 
         for song in songs:
-            normalized_name = normalize_song_name(song["song"])
+            record = SongRecord(
+                song["artists"],
+                song["spotify_artist_ids"],
+                song["spotify_song_id"],
+                song["song"],
+                song["duration_ms"],
+                song["album"],
+                song["spotify_popularity"],
+                song["isrc"],
+            )
 
-            if normalized_name not in grouped_songs:
-                grouped_songs[normalized_name] = {"variants": []}
-                variant_counter[normalized_name] = 1
-                grouped_songs[normalized_name]["variants"].append(
-                    {
-                        "artists": song["artists"],
-                        "artist_ids": song["spotify_artist_ids"],
-                        "spotify_song_id": song["spotify_song_id"],
-                        "song": song["song"],
-                        "duration_ms": song["duration_ms"],
-                        "album": song["album"],
-                        "spotify_popularity": song["spotify_popularity"],
-                        "isrc": song["isrc"],
-                    }
-                )
-            else:
-                matched_key = normalized_name
-                found_match = False
-                for i in range(1, variant_counter[normalized_name] + 1):
-                    matched_key = normalized_name if i == 1 else f"{normalized_name}_variant{i}"
+            key = isrc_index.get(record.isrc) if record.isrc else None
+            if key is None:
+                normalized_name = normalize_song_name(record.song)
+                durations, variant_numbers = duration_index.setdefault(normalized_name, ([], []))
 
-                    for grouped_song in grouped_songs[matched_key]["variants"]:
-                        duration_diff = abs(
-                            song["duration_ms"]
-                            - grouped_song["duration_ms"]
-                        )
-                        if duration_diff < threshold:
-                            found_match = True
-                            break
-                    
-                    if not found_match:
-                        break
-                    
-                if found_match:
-                    grouped_songs[matched_key]["variants"].append(
-                        {
-                            "artists": song["artists"],
-                            "artist_ids": song["spotify_artist_ids"],
-                            "spotify_song_id": song["spotify_song_id"],
-                            "song": song["song"],
-                            "duration_ms": song["duration_ms"],
-                            "album": song["album"],
-                            "spotify_popularity": song["spotify_popularity"],
-                            "isrc": song["isrc"],
-                        }
-                    )
+                low = bisect.bisect_right(durations, record.duration_ms - threshold)
+                high = bisect.bisect_left(durations, record.duration_ms + threshold)
+                if low < high:
+                    variant_number = min(variant_numbers[low:high])
                 else:
-                    variant_counter[normalized_name] += 1
-                    new_key = f"{normalized_name}_variant{variant_counter[normalized_name]}"
-                    grouped_songs[new_key] = {"variants": []}
-                    grouped_songs[new_key]["variants"].append(
-                        {
-                            "artists": song["artists"],
-                            "artist_ids": song["spotify_artist_ids"],
-                            "spotify_song_id": song["spotify_song_id"],
-                            "song": song["song"],
-                            "duration_ms": song["duration_ms"],
-                            "album": song["album"],
-                            "spotify_popularity": song["spotify_popularity"],
-                            "isrc": song["isrc"],
-                        }
-                    )
-        
-        return grouped_songs
+                    variant_number = variant_counter.get(normalized_name, 0) + 1
+                    variant_counter[normalized_name] = variant_number
+
+                position = bisect.bisect_right(durations, record.duration_ms)
+                durations.insert(position, record.duration_ms)
+                variant_numbers.insert(position, variant_number)
+                key = variant_key(normalized_name, variant_number)
+
+                if record.isrc:
+                    isrc_index[record.isrc] = key
+
+            groups.setdefault(key, []).append(record)
+
+        return {
+            key: {"variants": [record._asdict() for record in records]}
+            for key, records in groups.items()
+        }
     except Exception as e:
         logger.error(f"Error grouping song for artist {artist['artist']}: {e}")
         raise
@@ -211,16 +100,16 @@ def group_songs(artist, bucket_name, songs=None, threshold=20000):
 def write_grouped_songs_to_gcs(artists, bucket_name, base_blob_name):
     """Group songs for each artist and write grouped_songs.json to GCS."""
     try:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        
-        for artist in tqdm(artists, ncols=100, leave=True):
-            grouped_songs = group_songs(artist, bucket_name)
-            blob = bucket.blob(f"{artist['full_blob_name']}/grouped_songs.json")
-            blob.upload_from_string(
-                json.dumps(grouped_songs, indent=3, ensure_ascii=False)
-            )
-        
+        artists_songs = prefetch_artist_blobs(artists, bucket_name, ["songs.json"])
+        with UploadQueue() as uploads:
+            uploads.load_hashes(bucket_name, base_blob_name)
+            for artist, payloads in tqdm(artists_songs, total=len(artists), ncols=100, leave=True):
+                if "songs.json" not in payloads:
+                    logger.info(f"No songs for artist {artist['artist']}, skipping grouping.")
+                    continue
+                grouped_songs = group_songs(artist, bucket_name, payloads["songs.json"])
+                uploads.put_json(bucket_name, f"{artist['full_blob_name']}/grouped_songs.json", grouped_songs)
+
         logger.info(
             f"Successfully grouped songs for {len(artists)} artists to gcs bucket {bucket_name} with blob name {base_blob_name}"
         )
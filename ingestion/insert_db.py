@@ -1,105 +1,125 @@
 import logging
-from psycopg2.extras import execute_values
-from db.db import get_connection
+from db.bulk_load import load_parquet
+from ingestion.parquet_dataset import partition_blob_name
+from ingestion.storage import get_storage
 import argparse
-import pandas as pd
-import gcsfs
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s"
 )
 logger = logging.getLogger(__name__)
 
-"""This script inserts artists and albums into the database based on their per batch parquet files"""
+"""This script upserts artists, albums, songs and song groups into the database based on their per batch partitions of the parquet dataset"""
+
+BUCKET_NAME = "music--data"
+
+ARTISTS_COLUMNS = [
+    "spotify_artist_id",
+    "artist",
+    "monthly_listeners",
+    "followers",
+    "popularity",
+    "genres",
+    "images",
+]
+ALBUMS_COLUMNS = [
+    "spotify_album_id",
+    "album",
+    "artists",
+    "spotify_artist_ids",
+    "album_type",
+    "release_date",
+    "release_date_precision",
+    "total_tracks",
+    "images",
+]
+SONGS_COLUMNS = [
+    "spotify_song_id",
+    "spotify_album_id",
+    "song",
+    "album",
+    "origination_artist_id",
+    "artists",
+    "spotify_artist_ids",
+    "release_date_precision",
+    "release_date",
+    "duration_ms",
+    "explicit",
+    "images",
+    "isrc",
+    "total_streams",
+    "popularity",
+]
+SONG_GROUPS_COLUMNS = [
+    "origination_artist_id",
+    "group_key",
+    "song",
+    "canonical_spotify_song_id",
+    "isrc",
+    "variant_spotify_song_ids",
+    "variant_count",
+    "total_streams",
+    "popularity",
+]
 
-fs = gcsfs.GCSFileSystem()
 
-
-def get_artists_parquet():
-    """Read artists.parquet and return rows mapped to DB columns."""
-    df = pd.read_parquet(
-        f"gs://music--data/parquet_metadata/artists_kworbpage{args.page_number}/batch{args.batch_number}/artists.parquet",
-        filesystem=fs,
-    )
-    rows = [
-        (
-            row.spotify_artist_id,
-            row.artist,
-            int(row.monthly_listeners),
-            int(row.followers),
-            int(row.popularity),
-            list(row.genres),
-            list(row.images),
+def insert_artists():
+    """Bulk upsert artists.parquet into the artists table."""
+    try:
+        load_parquet(
+            f"{BUCKET_NAME}/{partition_blob_name('artists', args.page_number, args.batch_number)}",
+            "artists",
+            ARTISTS_COLUMNS,
+            "spotify_artist_id",
+            filesystem=get_storage().fs,
         )
-        for row in df.itertuples(index=False)
-    ]
-    return rows
+    except Exception as e:
+        logger.error(f"Error inserting artists: {e}")
+        raise
 
 
-def get_albums_parquet():
-    """Read albums.parquet and return rows mapped to DB columns."""
-    df = pd.read_parquet(
-        f"gs://music--data/parquet_metadata/artists_kworbpage{args.page_number}/batch{args.batch_number}/albums.parquet",
-        filesystem=fs,
-    )
-    rows = [
-        (
-            row.spotify_album_id,
-            row.album,
-            list(row.artists),
-            list(row.spotify_artist_ids),
-            row.album_type,
-            row.release_date,
-            row.release_date_precision,
-            int(row.total_tracks),
-            list(row.images),
+def insert_albums():
+    """Bulk upsert albums.parquet into the albums table."""
+    try:
+        load_parquet(
+            f"{BUCKET_NAME}/{partition_blob_name('albums', args.page_number, args.batch_number)}",
+            "albums",
+            ALBUMS_COLUMNS,
+            "spotify_album_id",
+            filesystem=get_storage().fs,
         )
-        for row in df.itertuples(index=False)
-    ]
-    return rows
+    except Exception as e:
+        logger.error(f"Error inserting albums: {e}")
+        raise
 
 
-def insert_artists():
-    """Bulk insert artist rows into the artists table."""
+def insert_songs():
+    """Bulk upsert songs.parquet into the songs table."""
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-
-        rows = get_artists_parquet()
-
-        query = """
-            INSERT INTO artists (spotify_artist_id, artist, monthly_listeners, followers, popularity, genres, images)
-            VALUES %s
-        """
-        execute_values(cur, query, rows)
-        conn.commit()
-        logger.info(f"Successfully inserted {len(rows)} artists into the artists table.")
-        cur.close()
-        conn.close()
+        load_parquet(
+            f"{BUCKET_NAME}/{partition_blob_name('songs', args.page_number, args.batch_number)}",
+            "songs",
+            SONGS_COLUMNS,
+            "spotify_song_id",
+            filesystem=get_storage().fs,
+        )
     except Exception as e:
-        logger.error(f"Error inserting artists: {e}")
+        logger.error(f"Error inserting songs: {e}")
         raise
 
 
-def insert_albums():
-    """Bulk insert album rows into the albums table."""
+def insert_song_groups():
+    """Bulk upsert song_groups.parquet into the song_groups table."""
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-
-        rows = get_albums_parquet()
-
-        query = """
-            INSERT INTO albums (spotify_album_id, album, artists, spotify_artist_ids, album_type, release_date, release_date_precision, total_tracks, images)
-            VALUES %s
-        """
-        execute_values(cur, query, rows)
-        conn.commit()
-        logger.info(f"Successfully inserted {len(rows)} albums into the albums table.")
-        cur.close()
-        conn.close()
+        load_parquet(
+            f"{BUCKET_NAME}/{partition_blob_name('song_groups', args.page_number, args.batch_number)}",
+            "song_groups",
+            SONG_GROUPS_COLUMNS,
+            ["origination_artist_id", "group_key"],
+            filesystem=get_storage().fs,
+        )
     except Exception as e:
-        logger.error(f"Error inserting albums: {e}")
+        logger.error(f"Error inserting song groups: {e}")
         raise
 
 
@@ -111,3 +131,5 @@ if __name__ == "__main__":
 
     insert_artists()
     insert_albums()
+    insert_songs()
+    insert_song_groups()
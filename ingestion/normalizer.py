@@ -0,0 +1,115 @@
+import re
+import unicodedata
+import string
+from functools import lru_cache
+
+# Versions that are truly different recordings/performances
+DISTINCT_VERSIONS = {
+    "live",
+    "acoustic",
+    "remix",
+    "mix",
+    "edit",
+    "instrumental",
+    "karaoke",
+    "demo",
+    "outtake",
+    "reprise",
+    "cover",
+    "unplugged",
+    "orchestral",
+    "cappella",
+    "acapella",
+    "stripped",
+    "strings",
+    "session",
+    "rehearsal",
+    "bootleg",
+    "alternate",
+}
+
+# Versions that are the same recording, just repackaged
+SAME_RECORDING = {
+    "remastered",
+    "remaster",
+    "remastering",
+    "deluxe",
+    "explicit",
+    "clean",
+    "album",
+    "version",
+    "single",
+    "original",
+    "standard",
+    "film",
+    "edition",
+    "anniversary",
+    "expanded",
+    "extended",
+    "bonus",
+    "special",
+    "collectors",
+    "collector",
+    "limited",
+    "radio",
+    "digital",
+    "vinyl",
+    "cd",
+    "stereo",
+    "mono",
+}
+
+# Every feat/ft/featuring pattern below contains one of these literals, so a title without a
+# match cannot be changed by them and skips all six substitutions.
+FEAT_PATTERN = re.compile(r"f(?:eat|t)", re.IGNORECASE)
+# Applied in order like before, a combined alternation would differ on titles where removing
+# one credit exposes another (e.g. "x -(feat. a)ft. b").
+FEAT_PATTERNS = [
+    re.compile(r"\s*[\(\[\{]\s*feat\.?[^\)\]\}]*[\)\]\}]", re.IGNORECASE),  # (feat. X)
+    re.compile(r"\s*[\(\[\{]\s*ft\.?[^\)\]\}]*[\)\]\}]", re.IGNORECASE),  # (ft. X)
+    re.compile(r"\s*[\(\[\{]\s*featuring[^\)\]\}]*[\)\]\}]", re.IGNORECASE),  # (featuring X)
+    re.compile(r"\s*-\s*feat\.?.*$", re.IGNORECASE),  # - feat. X
+    re.compile(r"\s*-\s*ft\.?.*$", re.IGNORECASE),  # - ft. X
+    re.compile(r"\s*-\s*featuring.*$", re.IGNORECASE),  # - featuring X
+]
+BRACKETED_YEAR_PATTERN = re.compile(r"\s*[\(\[\{]\s*\d{4}\s*[\)\]\}]")
+# Standalone 4-digit years starting with 10..20 (e.g., 1995, 2011) anywhere in the title
+YEAR_PATTERN = re.compile(r"\b(1[0-9]{3}|20[0-9]{2})\b")
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+
+NORMALIZE_CACHE_SIZE = 1 << 16
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_song_name(title: str) -> str:
+    """
+    Normalize Spotify track names for grouping.
+
+    Examples:
+        'Supersonic - Remastered' -> 'supersonic'
+        'Wonderwall (Live at Wembley)' -> 'wonderwall live'
+        'Champagne Supernova - Deluxe Edition' -> 'champagne supernova'
+    """
+    if not title:
+        return ""
+
+    normalized = unicodedata.normalize("NFKD", title).casefold()
+
+    if FEAT_PATTERN.search(normalized):
+        for pattern in FEAT_PATTERNS:
+            normalized = pattern.sub("", normalized)
+
+    normalized = BRACKETED_YEAR_PATTERN.sub("", normalized)
+    normalized = YEAR_PATTERN.sub("", normalized)
+
+    # str.split() splits on the same whitespace as \s, so it also collapses and strips it.
+    words = normalized.translate(PUNCTUATION_TABLE).split()
+
+    if not words:
+        return title.lower()
+
+    result = " ".join(
+        word for word in words if word in DISTINCT_VERSIONS or word not in SAME_RECORDING
+    )
+
+    return result if result else title.lower()
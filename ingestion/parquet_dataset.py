@@ -0,0 +1,162 @@
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+import argparse
+import logging
+
+from ingestion.storage import get_storage
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+"""Hive partitioned layout of the metadata parquet files, parquet_dataset/{table}/page={p}/batch={b}/part-0.parquet,
+with a _metadata summary of every file's row group statistics so readers can prune files without opening them."""
+
+BUCKET_NAME = "music--data"
+DATASET_PREFIX = "parquet_dataset"
+PART_FILE_NAME = "part-0.parquet"
+TABLES = ["artists", "albums", "songs", "song_groups"]
+
+
+def table_root(bucket_name, table):
+    """Path of a table's dataset directory on the storage filesystem"""
+    return f"{bucket_name}/{DATASET_PREFIX}/{table}"
+
+
+def partition_blob_name(table, page_number, batch_number):
+    """Blob name of the parquet file holding a table's rows for one (page, batch)"""
+    return f"{DATASET_PREFIX}/{table}/page={page_number}/batch={batch_number}/{PART_FILE_NAME}"
+
+
+def temporary_blob_name(blob_name):
+    """Blob name a part file is written under until it is complete. Readers and the summary skip files
+    starting with an underscore, so a partial file is never picked up."""
+    directory, name = blob_name.rsplit("/", 1)
+    return f"{directory}/_{name}.tmp"
+
+
+def relative_path(path, root):
+    """Path of a file below root, some filesystems list paths with a leading slash"""
+    return path.lstrip("/")[len(root) + 1 :]
+
+
+def read_file_metadata(filesystem, path, root):
+    """Reads a part file's footer, with its path made relative to the table root as _metadata stores it"""
+    with filesystem.open(path, "rb") as file:
+        metadata = pq.read_metadata(file)
+    metadata.set_file_path(relative_path(path, root))
+    return metadata
+
+
+def summary_file_paths(metadata):
+    """The part files a _metadata summary covers"""
+    return {
+        metadata.row_group(i).column(0).file_path for i in range(metadata.num_row_groups)
+    }
+
+
+def write_dataset_metadata(filesystem, root, metadata, schema):
+    """Writes _metadata (every row group) and _common_metadata (schema only) for a table"""
+    with filesystem.open(f"{root}/_metadata", "wb") as file:
+        metadata.write_metadata_file(file)
+    with filesystem.open(f"{root}/_common_metadata", "wb") as file:
+        pq.write_metadata(schema, file)
+
+
+def rebuild_dataset_metadata(filesystem, bucket_name, table, schema=None):
+    """Rebuilds a table's summary from the footers of all its part files"""
+    try:
+        root = table_root(bucket_name, table)
+        paths = sorted(
+            path for path in filesystem.find(root)
+            if path.endswith(".parquet") and not path.rsplit("/", 1)[-1].startswith("_")
+        )
+        if not paths:
+            logger.info(f"No parquet files under {root}, nothing to summarize.")
+            return
+
+        metadata = None
+        for path in paths:
+            file_metadata = read_file_metadata(filesystem, path, root)
+            if metadata is None:
+                metadata = file_metadata
+            else:
+                metadata.append_row_groups(file_metadata)
+
+        write_dataset_metadata(
+            filesystem, root, metadata, schema or metadata.schema.to_arrow_schema()
+        )
+        logger.info(
+            f"Rebuilt {root}/_metadata from {len(paths)} files, {metadata.num_row_groups} row groups."
+        )
+    except Exception as e:
+        logger.error(f"Error rebuilding dataset metadata for {table}: {e}")
+        raise
+
+
+def update_dataset_metadata(filesystem, bucket_name, table, blob_name, schema):
+    """Adds a freshly written part file to the table's summary.
+
+    The new footer is appended to the existing _metadata. A rerun of a batch overwrites a file
+    the summary already covers, and row groups can't be removed from it, so it is rebuilt instead.
+    """
+    try:
+        root = table_root(bucket_name, table)
+        metadata_path = f"{root}/_metadata"
+        file_metadata = read_file_metadata(filesystem, f"{bucket_name}/{blob_name}", root)
+
+        if not filesystem.exists(metadata_path):
+            write_dataset_metadata(filesystem, root, file_metadata, schema)
+            return
+
+        with filesystem.open(metadata_path, "rb") as file:
+            metadata = pq.read_metadata(file)
+        new_path = file_metadata.row_group(0).column(0).file_path if file_metadata.num_row_groups else None
+        if (
+            new_path is None
+            or new_path in summary_file_paths(metadata)
+            or not metadata.schema.equals(file_metadata.schema)
+        ):
+            rebuild_dataset_metadata(filesystem, bucket_name, table, schema)
+            return
+
+        metadata.append_row_groups(file_metadata)
+        write_dataset_metadata(filesystem, root, metadata, schema)
+        logger.info(f"Added {blob_name} to {metadata_path}.")
+    except Exception as e:
+        logger.error(f"Error updating dataset metadata for {table}: {e}")
+        raise
+
+
+def open_dataset(table, bucket_name=BUCKET_NAME, filesystem=None):
+    """Opens a table as a pyarrow dataset with page and batch partition columns.
+
+    With a _metadata summary, filters such as ds.field("popularity") > 80 are pruned against
+    row group statistics before any part file is opened.
+    """
+    try:
+        filesystem = filesystem or get_storage().fs
+        root = table_root(bucket_name, table)
+        if filesystem.exists(f"{root}/_metadata"):
+            return ds.parquet_dataset(
+                f"{root}/_metadata", filesystem=filesystem, partitioning="hive"
+            )
+        return ds.dataset(root, filesystem=filesystem, format="parquet", partitioning="hive")
+    except Exception as e:
+        logger.error(f"Error opening dataset {table}: {e}")
+        raise
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--table", choices=TABLES, action="append", help="Tables to rebuild, defaults to all")
+    args = parser.parse_args()
+
+    try:
+        fs = get_storage().fs
+        for table in args.table or TABLES:
+            rebuild_dataset_metadata(fs, BUCKET_NAME, table)
+    except Exception as e:
+        logger.error(f"Error running the script parquet_dataset.py: {e}")
+        raise
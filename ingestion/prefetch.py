@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import logging
+
+from ingestion.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_WORKERS = 16
+
+
+def list_artist_blobs(artists, bucket_name):
+    """Lists the batch prefixes of the artists once, returns the set of existing blob names"""
+    storage = get_storage()
+    prefixes = {artist["full_blob_name"].rsplit("/", 1)[0] for artist in artists}
+    blob_names = set()
+    for prefix in prefixes:
+        blob_names.update(storage.list(bucket_name, prefix))
+    return blob_names
+
+
+def prefetch_artist_blobs(artists, bucket_name, file_names, max_workers=PREFETCH_WORKERS):
+    """Yields (artist, {file_name: parsed json}) in artist order while the next artists' blobs download.
+
+    The batch prefix is listed once up front, so blobs an artist doesn't have (e.g. albums.json when
+    all its albums were already known) are left out of its payloads instead of costing a failed read.
+    At most 2 * max_workers artists are downloaded ahead of the consumer.
+    """
+    storage = get_storage()
+    existing_blobs = list_artist_blobs(artists, bucket_name)
+
+    def load(artist):
+        payloads = {}
+        for file_name in file_names:
+            blob_name = f"{artist['full_blob_name']}/{file_name}"
+            if blob_name in existing_blobs:
+                payloads[file_name] = storage.read_json(bucket_name, blob_name)
+        return payloads
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        remaining = iter(artists)
+        pending = deque()
+        for artist in remaining:
+            pending.append((artist, executor.submit(load, artist)))
+            if len(pending) >= 2 * max_workers:
+                break
+
+        while pending:
+            artist, future = pending.popleft()
+            next_artist = next(remaining, None)
+            if next_artist is not None:
+                pending.append((next_artist, executor.submit(load, next_artist)))
+            try:
+                payloads = future.result()
+            except Exception as e:
+                logger.error(f"Error prefetching {file_names} for artist {artist['artist']}: {e}")
+                raise
+            yield artist, payloads
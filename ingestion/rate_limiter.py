@@ -0,0 +1,93 @@
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Token bucket whose refill rate adapts to what the API accepts.
+
+    The rate grows additively on every accepted request and is cut multiplicatively
+    on a 429, so it settles just under the sustainable rate. A Retry-After blocks the
+    bucket for exactly that long.
+    """
+
+    def __init__(
+        self,
+        rate=10.0,
+        burst=10,
+        min_rate=0.5,
+        max_rate=50.0,
+        increase=0.5,
+        decrease=0.5,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.throttle_count = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """Seconds until a request could be let through, 0 when there is headroom"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self._refill(now)
+            if self.tokens >= 1:
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Blocks until a token is available and takes it"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                else:
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        """Additive increase: about `increase` requests/second more per second of clean traffic"""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_rate_limited(self, retry_after=None):
+        """Multiplicative decrease, and block for exactly Retry-After seconds when given"""
+        with self._lock:
+            now = time.monotonic()
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = 0.0
+            self.updated = now
+            self.throttle_count += 1
+            if retry_after is not None:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            logger.warning(
+                f"Rate limited by Spotify, lowering request rate to {self.rate:.2f}/s and blocking for {retry_after} seconds."
+            )
+
+
+def parse_retry_after(value, default=1.0):
+    """Parses a Retry-After header given in seconds"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default
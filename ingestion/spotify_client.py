@@ -0,0 +1,183 @@
+import requests
+from requests.adapters import HTTPAdapter
+from collections import Counter
+import threading
+import logging
+import time
+
+from auth import get_token_pool
+from ingestion.rate_limiter import parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+API_URL = "https://api.spotify.com/v1"
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class SpotifyClient:
+    """Spotify Web API client that keeps one pooled keep-alive session for every request in the process"""
+
+    def __init__(
+        self,
+        token_pool,
+        max_retries=3,
+        max_rate_limited_retries=10,
+        sleep_time=1,
+        pool_size=32,
+        timeout=10,
+    ):
+        self.token_pool = token_pool
+        self.max_retries = max_retries
+        self.max_rate_limited_retries = max_rate_limited_retries
+        self.sleep_time = sleep_time
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+
+        # Number of HTTP calls made per endpoint and per credential, retries included.
+        self.call_counts = Counter()
+        self.credential_counts = Counter()
+        self._counts_lock = threading.Lock()
+
+    def _backoff(self, endpoint, attempt, exception):
+        backoff_time = self.sleep_time * (2**attempt)
+        logger.warning(
+            f"Error calling Spotify endpoint {endpoint}: {exception}. Retrying in {backoff_time} seconds."
+        )
+        time.sleep(backoff_time)
+
+    def _get(self, endpoint, url, params=None):
+        """Sends a GET request with the least throttled credential and returns the json body.
+
+        Network errors and 5xx responses are retried with exponential backoff. A 429 is
+        retried after exactly the Retry-After Spotify asks for, which that credential's
+        limiter enforces while the other credentials keep serving requests.
+        """
+        last_exception = None
+        attempt = 0
+        rate_limited_attempts = 0
+        while attempt < self.max_retries and rate_limited_attempts <= self.max_rate_limited_retries:
+            credential = self.token_pool.acquire()
+            with self._counts_lock:
+                self.call_counts[endpoint] += 1
+                self.credential_counts[credential.num] += 1
+
+            try:
+                headers = {"Authorization": f"Bearer {credential.get_token()}"}
+                response = self.session.get(
+                    url, headers=headers, params=params, timeout=self.timeout
+                )
+            except requests.RequestException as e:
+                last_exception = e
+                self._backoff(endpoint, attempt, e)
+                attempt += 1
+                continue
+
+            if response.status_code == 429:
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                credential.limiter.on_rate_limited(retry_after)
+                last_exception = requests.HTTPError(
+                    f"429 Too Many Requests for url: {response.url}", response=response
+                )
+                rate_limited_attempts += 1
+                continue
+
+            # An expired or revoked token: fetch a new one and retry.
+            if response.status_code == 401:
+                credential.invalidate()
+
+            try:
+                response.raise_for_status()
+            except requests.HTTPError as e:
+                # Client errors other than rate limiting will not go away on a retry.
+                if response.status_code < 500 and response.status_code != 401:
+                    logger.error(f"Error calling Spotify endpoint {endpoint}: {e}")
+                    raise
+                last_exception = e
+                self._backoff(endpoint, attempt, e)
+                attempt += 1
+                continue
+
+            credential.limiter.on_success()
+            return response.json()
+
+        logger.error(
+            f"Error calling Spotify endpoint {endpoint}: {last_exception}. Failed after {attempt + rate_limited_attempts} attempts."
+        )
+        raise last_exception
+
+    def get_artists(self, artist_ids):
+        """Gets up to 50 artists by id"""
+        return self._get(
+            "artists", f"{API_URL}/artists", params={"ids": ",".join(artist_ids)}
+        )
+
+    def get_artist_albums(
+        self, artist_id, limit=50, offset=0, include_groups="album,single", market="US"
+    ):
+        """Gets one page of an artist's albums"""
+        params = {
+            "limit": limit,
+            "offset": offset,
+            "include_groups": include_groups,
+            "market": market,
+        }
+        return self._get(
+            "artist_albums", f"{API_URL}/artists/{artist_id}/albums", params=params
+        )
+
+    def get_albums(self, album_ids):
+        """Gets up to 20 albums by id, each with the first page of its tracks embedded"""
+        return self._get("albums", f"{API_URL}/albums", params={"ids": ",".join(album_ids)})
+
+    def get_album_tracks(self, album_id, limit=50, offset=0):
+        """Gets one page of an album's tracks"""
+        params = {"limit": limit, "offset": offset}
+        return self._get(
+            "album_tracks", f"{API_URL}/albums/{album_id}/tracks", params=params
+        )
+
+    def get_artist_top_tracks(self, artist_id):
+        """Gets the top tracks of an artist"""
+        return self._get("artist_top_tracks", f"{API_URL}/artists/{artist_id}/top-tracks")
+
+    def get_tracks(self, track_ids):
+        """Gets up to 50 tracks by id"""
+        return self._get("tracks", f"{API_URL}/tracks", params={"ids": ",".join(track_ids)})
+
+    def get_next_page(self, endpoint, next_url):
+        """Follows a paging object's `next` url, which already carries its query params"""
+        return self._get(endpoint, next_url)
+
+    def log_call_counts(self):
+        """Logs how many calls were made to each endpoint"""
+        with self._counts_lock:
+            counts = dict(self.call_counts)
+            credential_counts = dict(self.credential_counts)
+        total = sum(counts.values())
+        logger.info(
+            f"Spotify API calls: {total} total, per endpoint {counts}, per credential {credential_counts}"
+        )
+        for credential in self.token_pool.credentials:
+            logger.info(
+                f"Spotify credential {credential.num}: {credential.limiter.throttle_count} rate limited, settled at {credential.limiter.rate:.2f} requests/s"
+            )
+
+
+def get_spotify_client(num=None):
+    """Returns the process wide client, creating it on first use.
+
+    By default requests rotate over every configured credential, passing `num` pins
+    the client to that single credential.
+    """
+    with _clients_lock:
+        if num not in _clients:
+            token_pool = get_token_pool()
+            if num is not None:
+                token_pool = token_pool.subset([num])
+            _clients[num] = SpotifyClient(token_pool)
+        return _clients[num]
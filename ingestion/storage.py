@@ -0,0 +1,183 @@
+from google.cloud import storage
+from fsspec.implementations.dirfs import DirFileSystem
+from fsspec.implementations.local import LocalFileSystem
+from fsspec.implementations.memory import MemoryFileSystem
+import gcsfs
+import threading
+import hashlib
+import base64
+import os
+import logging
+
+from ingestion.codec import encode_json, decode_json, content_encoding
+
+logger = logging.getLogger(__name__)
+
+"""Blob storage shared by every stage. STORAGE_BACKEND picks gcs (default), local or memory; the local
+backend keeps one directory per bucket under STORAGE_ROOT. Blobs are addressed by (bucket_name, blob_name)
+and `fs` exposes the same blobs as an fsspec filesystem, with "{bucket_name}/{blob_name}" paths, for pyarrow."""
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "gcs")
+STORAGE_ROOT = os.getenv("STORAGE_ROOT", ".storage")
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+class Storage:
+    """Blob storage over an fsspec filesystem"""
+
+    def __init__(self, fs):
+        self.fs = fs
+
+    def path(self, bucket_name, blob_name):
+        """The blob's path on fs"""
+        return f"{bucket_name}/{blob_name}"
+
+    def read(self, bucket_name, blob_name):
+        """Returns the blob's bytes"""
+        return self.fs.cat_file(self.path(bucket_name, blob_name))
+
+    def read_range(self, bucket_name, blob_name, start, end=None):
+        """Returns bytes [start, end) of the blob, a negative start counts from the end"""
+        return self.fs.cat_file(self.path(bucket_name, blob_name), start, end)
+
+    def write(self, bucket_name, blob_name, data, content_type=None, content_encoding=None):
+        """Creates or replaces the blob, str data is written as utf-8"""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.fs.pipe_file(self.path(bucket_name, blob_name), data)
+
+    def exists(self, bucket_name, blob_name):
+        return self.fs.exists(self.path(bucket_name, blob_name))
+
+    def list(self, bucket_name, prefix):
+        """Returns the names of the blobs under prefix"""
+        root = self.path(bucket_name, prefix).rstrip("/")
+        if not self.fs.exists(root):
+            return []
+        return sorted(path.lstrip("/")[len(bucket_name) + 1 :] for path in self.fs.find(root))
+
+    def open(self, bucket_name, blob_name, mode="rb"):
+        """Opens the blob as a file, e.g. for a streaming parquet writer"""
+        return self.fs.open(self.path(bucket_name, blob_name), mode)
+
+    def stat(self, bucket_name, blob_name):
+        """Returns the backend's info dict for the blob, with at least its size"""
+        return self.fs.info(self.path(bucket_name, blob_name))
+
+    def delete(self, bucket_name, blob_name):
+        self.fs.rm(self.path(bucket_name, blob_name))
+
+    def move(self, bucket_name, blob_name, new_blob_name):
+        """Renames the blob, replacing any blob already at new_blob_name"""
+        self.fs.mv(self.path(bucket_name, blob_name), self.path(bucket_name, new_blob_name))
+
+    def md5(self, bucket_name, blob_name):
+        """Returns the stored blob's content_md5, None if it doesn't exist"""
+        if not self.exists(bucket_name, blob_name):
+            return None
+        return content_md5(self.read(bucket_name, blob_name))
+
+    def list_md5(self, bucket_name, prefix):
+        """Returns {blob name: content_md5} for the blobs under prefix"""
+        return {
+            blob_name: content_md5(self.read(bucket_name, blob_name))
+            for blob_name in self.list(bucket_name, prefix)
+        }
+
+    def write_if_changed(self, bucket_name, blob_name, data, content_type=None, content_encoding=None):
+        """Writes the blob unless it already holds exactly data, returns whether it was written"""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if self.md5(bucket_name, blob_name) == content_md5(data):
+            return False
+        self.write(bucket_name, blob_name, data, content_type=content_type, content_encoding=content_encoding)
+        return True
+
+    def read_json(self, bucket_name, blob_name):
+        return decode_json(self.read(bucket_name, blob_name))
+
+    def write_json(self, bucket_name, blob_name, data):
+        encoded = encode_json(data)
+        written = self.write_if_changed(
+            bucket_name,
+            blob_name,
+            encoded,
+            content_type="application/json",
+            content_encoding=content_encoding(encoded),
+        )
+        if not written:
+            logger.info(f"Skipped unchanged {blob_name}, {len(encoded)} bytes")
+
+
+class GCSStorage(Storage):
+    """GCS through one storage client for blob reads and writes and one gcsfs filesystem for pyarrow"""
+
+    def __init__(self):
+        super().__init__(gcsfs.GCSFileSystem())
+        self.client = storage.Client()
+        self._buckets = {}
+
+    def bucket(self, bucket_name):
+        if bucket_name not in self._buckets:
+            self._buckets[bucket_name] = self.client.bucket(bucket_name)
+        return self._buckets[bucket_name]
+
+    def write(self, bucket_name, blob_name, data, content_type=None, content_encoding=None):
+        blob = self.bucket(bucket_name).blob(blob_name)
+        blob.content_encoding = content_encoding
+        blob.upload_from_string(data, content_type=content_type)
+
+    def read(self, bucket_name, blob_name):
+        # Without raw_download gzip blobs are decompressed in transit, decode_json handles either form.
+        return self.bucket(bucket_name).blob(blob_name).download_as_bytes(raw_download=True)
+
+    def read_range(self, bucket_name, blob_name, start, end=None):
+        # The client's end is inclusive.
+        return self.bucket(bucket_name).blob(blob_name).download_as_bytes(
+            start=start, end=None if end is None else end - 1, raw_download=True
+        )
+
+    def list(self, bucket_name, prefix):
+        return sorted(blob.name for blob in self.client.list_blobs(bucket_name, prefix=prefix))
+
+    def md5(self, bucket_name, blob_name):
+        # Only the object's metadata is fetched, GCS keeps the md5 of every non composite object.
+        blob = self.bucket(bucket_name).get_blob(blob_name)
+        return blob.md5_hash if blob is not None else None
+
+    def list_md5(self, bucket_name, prefix):
+        return {
+            blob.name: blob.md5_hash
+            for blob in self.client.list_blobs(
+                bucket_name, prefix=prefix, fields="items(name,md5Hash),nextPageToken"
+            )
+        }
+
+
+def content_md5(data):
+    """Base64 md5 of the bytes, the form GCS reports an object's md5 in"""
+    return base64.b64encode(hashlib.md5(data).digest()).decode("ascii")
+
+
+def create_storage(backend=STORAGE_BACKEND, root=STORAGE_ROOT):
+    """Builds the storage for a backend name"""
+    if backend == "gcs":
+        return GCSStorage()
+    if backend == "local":
+        os.makedirs(root, exist_ok=True)
+        return Storage(DirFileSystem(os.path.abspath(root), fs=LocalFileSystem(auto_mkdir=True)))
+    if backend == "memory":
+        return Storage(MemoryFileSystem())
+    raise ValueError(f"Unknown storage backend {backend}, expected gcs, local or memory")
+
+
+def get_storage():
+    """Returns the process wide storage, creating it on first use"""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = create_storage()
+            logger.info(f"Using {STORAGE_BACKEND} storage")
+        return _storage
@@ -0,0 +1,114 @@
+import sqlite3
+import threading
+import json
+import time
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+TRACK_STORE_PATH = os.getenv("TRACK_STORE_PATH", ".cache/spotify_tracks.sqlite")
+# Popularity drifts, so a stored track is refetched once it is older than this.
+TRACK_POPULARITY_TTL_DAYS = float(os.getenv("TRACK_POPULARITY_TTL_DAYS", 7))
+TRACKS_BATCH_SIZE = 50
+# Keeps IN (...) queries under sqlite's bound parameter limit.
+SQLITE_IN_BATCH_SIZE = 500
+
+_track_store = None
+_track_store_lock = threading.Lock()
+
+
+class TrackStore:
+    """On-disk store of full Spotify track objects keyed by spotify_song_id, shared across runs"""
+
+    def __init__(self, path=TRACK_STORE_PATH, ttl_days=TRACK_POPULARITY_TTL_DAYS):
+        self.path = path
+        self.ttl_seconds = ttl_days * 86400
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tracks (
+                    spotify_song_id TEXT PRIMARY KEY,
+                    track TEXT NOT NULL,
+                    fetched_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.commit()
+
+    def get_many(self, track_ids):
+        """Returns {spotify_song_id: track} for the ids stored within the TTL"""
+        fresh_after = time.time() - self.ttl_seconds
+        tracks = {}
+        track_ids = list(track_ids)
+        with self._lock:
+            for i in range(0, len(track_ids), SQLITE_IN_BATCH_SIZE):
+                batch = track_ids[i : i + SQLITE_IN_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT spotify_song_id, track FROM tracks WHERE fetched_at >= ? AND spotify_song_id IN ({placeholders})",
+                    [fresh_after, *batch],
+                ).fetchall()
+                for spotify_song_id, track in rows:
+                    tracks[spotify_song_id] = json.loads(track)
+        return tracks
+
+    def put_many(self, tracks):
+        """Stores full track objects, e.g. from /tracks or /artists/{id}/top-tracks"""
+        now = time.time()
+        rows = [
+            (track["id"], json.dumps(track, ensure_ascii=False), now)
+            for track in tracks
+            if track and track.get("id")
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO tracks (spotify_song_id, track, fetched_at) VALUES (?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def get_tracks(self, client, track_ids):
+        """Returns {spotify_song_id: track} for track_ids, only fetching the ids missing or stale in the store.
+        Ids Spotify does not know are left out."""
+        try:
+            track_ids = list(dict.fromkeys(track_ids))
+            tracks = self.get_many(track_ids)
+            missing_ids = [track_id for track_id in track_ids if track_id not in tracks]
+            self.hits += len(tracks)
+            self.misses += len(missing_ids)
+
+            for i in range(0, len(missing_ids), TRACKS_BATCH_SIZE):
+                response = client.get_tracks(missing_ids[i : i + TRACKS_BATCH_SIZE])
+                fetched = [track for track in response["tracks"] if track]
+                self.put_many(fetched)
+                for track in fetched:
+                    tracks[track["id"]] = track
+            return tracks
+        except Exception as e:
+            logger.error(f"Error getting tracks through the track store: {e}")
+            raise
+
+    def log_stats(self):
+        """Logs how many track lookups were served from the store"""
+        logger.info(
+            f"Track store {self.path}: {self.hits} served from the store, {self.misses} fetched from Spotify"
+        )
+
+
+def get_track_store():
+    """Returns the process wide track store, opening it on first use"""
+    global _track_store
+    with _track_store_lock:
+        if _track_store is None:
+            _track_store = TrackStore()
+        return _track_store
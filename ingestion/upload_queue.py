@@ -0,0 +1,167 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import logging
+
+from ingestion.storage import get_storage, content_md5
+from ingestion.codec import encode_json, content_encoding
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_WORKERS = 8
+MAX_PENDING_UPLOADS = 64
+
+
+class UploadQueue:
+    """Uploads blobs on background threads so a stage can fetch the next artist while the last one is written.
+
+    At most max_pending uploads are queued or running, put() blocks beyond that so memory stays bounded.
+    A failed upload is logged with its blob name and doesn't stop the others; flush() waits for every queued
+    upload and raises if any failed. Used as a context manager, the queue is flushed on exit.
+
+    A blob already holding the same bytes is not uploaded again, so rerunning a batch mostly costs hash lookups.
+    load_hashes() lists the stored hashes of a whole prefix at once, blobs outside loaded prefixes are looked
+    up one by one.
+    """
+
+    def __init__(self, storage=None, max_workers=UPLOAD_WORKERS, max_pending=MAX_PENDING_UPLOADS):
+        self.storage = storage or get_storage()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="upload")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._futures = []
+        self.failed = []
+        self.uploaded_count = 0
+        self.uploaded_bytes = 0
+        self.skipped_count = 0
+        self.skipped_bytes = 0
+        self._hashes = {}
+        self._hashed_prefixes = []
+
+    def load_hashes(self, bucket_name, prefix):
+        """Lists the stored hashes of every blob under prefix, typically the batch's base blob name"""
+        # batch1 must not also list batch10 to batch19.
+        prefix = f"{prefix.rstrip('/')}/"
+        hashes = self.storage.list_md5(bucket_name, prefix)
+        with self._lock:
+            self._hashes.update(((bucket_name, blob_name), md5) for blob_name, md5 in hashes.items())
+            self._hashed_prefixes.append((bucket_name, prefix))
+        logger.info(f"Loaded the hashes of {len(hashes)} blobs under {prefix}")
+
+    def _stored_md5(self, bucket_name, blob_name):
+        with self._lock:
+            if (bucket_name, blob_name) in self._hashes:
+                return self._hashes[(bucket_name, blob_name)]
+            listed = any(
+                bucket_name == bucket and blob_name.startswith(prefix)
+                for bucket, prefix in self._hashed_prefixes
+            )
+        # A blob missing from a listed prefix doesn't exist, there's nothing to look up.
+        return None if listed else self.storage.md5(bucket_name, blob_name)
+
+    def put(self, bucket_name, blob_name, data, content_type=None, content_encoding=None):
+        """Queues a write of data to the blob, blocking while max_pending uploads are in flight"""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(
+                self._upload, bucket_name, blob_name, data, content_type, content_encoding
+            )
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._futures.append(future)
+
+    def put_json(self, bucket_name, blob_name, data):
+        """Queues a json blob, serialized now so the caller can keep mutating data"""
+        encoded = encode_json(data)
+        self.put(
+            bucket_name,
+            blob_name,
+            encoded,
+            content_type="application/json",
+            content_encoding=content_encoding(encoded),
+        )
+
+    def write_now(self, bucket_name, blob_name, data, content_type=None, content_encoding=None):
+        """Writes the blob on the calling thread and raises if that fails. Blobs the queue may also put
+        must be written through here, a write behind the queue's back leaves it comparing against a stale hash."""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._write(bucket_name, blob_name, data, content_type, content_encoding)
+
+    def write_json_now(self, bucket_name, blob_name, data):
+        """write_now for a json blob"""
+        encoded = encode_json(data)
+        self.write_now(
+            bucket_name,
+            blob_name,
+            encoded,
+            content_type="application/json",
+            content_encoding=content_encoding(encoded),
+        )
+
+    def _write(self, bucket_name, blob_name, data, content_type, content_encoding):
+        md5 = content_md5(data)
+        written = self._stored_md5(bucket_name, blob_name) != md5
+        if written:
+            self.storage.write(
+                bucket_name, blob_name, data, content_type=content_type, content_encoding=content_encoding
+            )
+        with self._lock:
+            self._hashes[(bucket_name, blob_name)] = md5
+            if written:
+                self.uploaded_count += 1
+                self.uploaded_bytes += len(data)
+            else:
+                self.skipped_count += 1
+                self.skipped_bytes += len(data)
+
+    def _upload(self, bucket_name, blob_name, data, content_type, content_encoding):
+        try:
+            self._write(bucket_name, blob_name, data, content_type, content_encoding)
+        except Exception as e:
+            logger.error(f"Error uploading {blob_name} to bucket {bucket_name}: {e}")
+            with self._lock:
+                self.failed.append((blob_name, e))
+        finally:
+            self._slots.release()
+
+    def flush(self):
+        """Waits for every queued upload, raises if any of them failed"""
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+        with self._lock:
+            failed, self.failed = self.failed, []
+        if failed:
+            raise RuntimeError(
+                f"{len(failed)} uploads failed: {', '.join(blob_name for blob_name, _ in failed)}"
+            )
+        logger.info(
+            f"Uploaded {self.uploaded_count} blobs, {self.uploaded_bytes / (1 << 20):.1f} MB in total, "
+            f"skipped {self.skipped_count} unchanged blobs, {self.skipped_bytes / (1 << 20):.1f} MB."
+        )
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+            else:
+                # The stage already failed, finish what was queued without masking its error.
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error(f"Error flushing uploads after a failed stage: {e}")
+        finally:
+            self.close()
+        return False
@@ -1,18 +1,15 @@
-from google.cloud import storage
-import json
 import logging
 
+from ingestion.storage import get_storage
+from ingestion.album_songs import ALBUM_SONGS_FILE, read_album_songs
+
 logger = logging.getLogger(__name__)
 
 
 def get_artists_from_gcs(bucket_name, blob_name):
     """Gets the artists from the gcs bucket"""
     try:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(blob_name)
-        artists = json.loads(blob.download_as_string())
-        return artists
+        return get_storage().read_json(bucket_name, blob_name)
     except Exception as e:
         logger.error(
             f"Error getting artists from gcs bucket {bucket_name} with blob name {blob_name}: {e}"
@@ -22,12 +19,8 @@ def get_artists_from_gcs(bucket_name, blob_name):
 def get_albums_from_gcs(artist, bucket_name):
     """Gets the albums from the gcs bucket for a given artist"""
     try:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
         blob_name = f"{artist['full_blob_name']}/albums.json"
-        blob = bucket.blob(blob_name)
-        albums = json.loads(blob.download_as_string())
-        return albums
+        return get_storage().read_json(bucket_name, blob_name)
     except Exception as e:
         logger.error(
             f"Error getting albums from gcs bucket {bucket_name} with blob name {blob_name}: {e}"
@@ -37,10 +30,7 @@ def get_albums_from_gcs(artist, bucket_name):
 def get_artist_songs_from_gcs(artist, bucket_name):
     """Gets all the songs combined from the gcs bucket for a given artist"""
     try:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(f"{artist['full_blob_name']}/songs.json")
-        return json.loads(blob.download_as_string())
+        return get_storage().read_json(bucket_name, f"{artist['full_blob_name']}/songs.json")
     except Exception as e:
         logger.error(
             f"Error getting all artist songs from gcs bucket {bucket_name} with blob name {artist['full_blob_name']}/songs.json: {e}"
@@ -48,18 +38,33 @@ def get_artist_songs_from_gcs(artist, bucket_name):
         raise
 
 def get_artist_grouped_songs_from_gcs(artist, bucket_name):
-    """Gets all the songs combined from the gcs bucket for a given artist"""
+    """Gets the grouped songs from the gcs bucket for a given artist"""
     try:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(f"{artist['full_blob_name']}/grouped_songs.json")
-        return json.loads(blob.download_as_string())
+        return get_storage().read_json(bucket_name, f"{artist['full_blob_name']}/grouped_songs.json")
     except Exception as e:
         logger.error(
             f"Error getting all artist songs from gcs bucket {bucket_name} with blob name {artist['full_blob_name']}/songs.json: {e}"
         )
         raise
 
+def get_album_songs_from_gcs(artist, bucket_name, album_id):
+    """Gets the songs of one of an artist's albums or singles, None if the artist has no such album.
+    Reads the album from the artist's album songs container, or its own songs.json for batches written before it."""
+    try:
+        storage = get_storage()
+        blob_name = f"{artist['full_blob_name']}/{ALBUM_SONGS_FILE}"
+        if storage.exists(bucket_name, blob_name):
+            return read_album_songs(storage, bucket_name, blob_name, album_id)
+        legacy_blob_name = f"{artist['full_blob_name']}/{album_id}/songs.json"
+        if storage.exists(bucket_name, legacy_blob_name):
+            return storage.read_json(bucket_name, legacy_blob_name)
+        return None
+    except Exception as e:
+        logger.error(
+            f"Error getting album {album_id} songs from gcs bucket {bucket_name} for artist {artist['artist']}: {e}"
+        )
+        raise
+
 
 def normalize_release_date(release_date, release_date_precision):
     """Normalize release date based on precision: year -> YYYY-01-01, month -> YYYY-MM-01."""
@@ -0,0 +1,128 @@
+import functools
+
+import pytest
+
+import ingestion.album_songs as album_songs_module
+import ingestion.utils as utils
+from ingestion.album_songs import (
+    ALBUM_SONGS_FILE,
+    FOOTER,
+    decode_album_songs,
+    decode_index,
+    encode_album_songs,
+    read_album_songs,
+    read_album_songs_index,
+)
+from ingestion.codec import encode_json
+from ingestion.storage import create_storage
+
+BUCKET_NAME = "bucket"
+ARTIST = {"artist": "Artist", "full_blob_name": "raw/batch1/Artist"}
+BLOB_NAME = f"{ARTIST['full_blob_name']}/{ALBUM_SONGS_FILE}"
+
+
+def make_song(song_id, album_id):
+    return {
+        "spotify_song_id": song_id,
+        "spotify_album_id": album_id,
+        "song": f"Song {song_id}",
+        "images": [f"https://i.scdn.co/image/{album_id}"],
+    }
+
+
+def make_album_songs(album_count, songs_per_album=3):
+    return {
+        f"al{i}": [make_song(f"s{i}_{j}", f"al{i}") for j in range(songs_per_album)]
+        for i in range(album_count)
+    }
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """Local storage recording its ranged reads"""
+    storage = create_storage("local", str(tmp_path))
+    storage.ranges = []
+    read_range = storage.read_range
+
+    def counting_read_range(bucket_name, blob_name, start, end=None):
+        storage.ranges.append((start, end))
+        return read_range(bucket_name, blob_name, start, end)
+
+    monkeypatch.setattr(storage, "read_range", counting_read_range)
+    monkeypatch.setattr(utils, "get_storage", lambda: storage)
+    return storage
+
+
+@pytest.fixture(params=["zstd", "gzip", "none"])
+def compression(request, monkeypatch):
+    monkeypatch.setattr(
+        album_songs_module, "encode_json", functools.partial(encode_json, compression=request.param)
+    )
+    return request.param
+
+
+def test_decodes_a_whole_container(compression):
+    album_songs = make_album_songs(4)
+    assert decode_album_songs(encode_album_songs(album_songs)) == album_songs
+
+
+def test_decodes_an_empty_container(compression):
+    assert decode_album_songs(encode_album_songs({})) == {}
+
+
+def test_index_points_at_each_album(compression):
+    album_songs = make_album_songs(3)
+    data = encode_album_songs(album_songs)
+    index, needed = decode_index(data, BLOB_NAME)
+    assert list(index) == list(album_songs)
+    assert data[-FOOTER.size :].endswith(b"ASP1")
+    assert sum(length for _, length in index.values()) + needed == len(data)
+
+
+def test_rejects_blobs_that_are_not_containers():
+    with pytest.raises(ValueError):
+        decode_index(encode_json([make_song("s0", "al0")], "none") + b"\0" * FOOTER.size, BLOB_NAME)
+
+
+def test_short_tail_asks_for_the_index_size():
+    data = encode_album_songs(make_album_songs(20))
+    index_and_footer = decode_index(data, BLOB_NAME)[1]
+    assert decode_index(data[-FOOTER.size :], BLOB_NAME) == (None, index_and_footer)
+
+
+def test_reads_one_album_with_two_ranged_reads(storage, compression):
+    album_songs = make_album_songs(5)
+    storage.write(BUCKET_NAME, BLOB_NAME, encode_album_songs(album_songs))
+    assert read_album_songs(storage, BUCKET_NAME, BLOB_NAME, "al3") == album_songs["al3"]
+    assert len(storage.ranges) == 2
+    assert read_album_songs(storage, BUCKET_NAME, BLOB_NAME, "missing") is None
+
+
+def test_reads_an_index_larger_than_the_tail(storage, compression, monkeypatch):
+    monkeypatch.setattr(album_songs_module, "TAIL_BYTES", 64)
+    album_songs = make_album_songs(50, songs_per_album=1)
+    data = encode_album_songs(album_songs)
+    storage.write(BUCKET_NAME, BLOB_NAME, data)
+    assert decode_index(data, BLOB_NAME)[1] > 64
+
+    index = read_album_songs_index(storage, BUCKET_NAME, BLOB_NAME)
+    assert list(index) == list(album_songs)
+    assert len(storage.ranges) == 2
+    for album_id in ("al0", "al49"):
+        assert read_album_songs(storage, BUCKET_NAME, BLOB_NAME, album_id) == album_songs[album_id]
+
+
+def test_reads_albums_from_the_container(storage, compression):
+    album_songs = make_album_songs(2)
+    storage.write(BUCKET_NAME, BLOB_NAME, encode_album_songs(album_songs))
+    storage.write_json(BUCKET_NAME, f"{ARTIST['full_blob_name']}/al0/songs.json", [make_song("old", "al0")])
+    assert utils.get_album_songs_from_gcs(ARTIST, BUCKET_NAME, "al0") == album_songs["al0"]
+    assert utils.get_album_songs_from_gcs(ARTIST, BUCKET_NAME, "al9") is None
+
+
+def test_falls_back_to_the_album_songs_json(storage):
+    songs = [make_song("s0", "al0"), make_song("s1", "al0")]
+    storage.write_json(BUCKET_NAME, f"{ARTIST['full_blob_name']}/al0/songs.json", songs)
+    assert utils.get_album_songs_from_gcs(ARTIST, BUCKET_NAME, "al0") == songs
+    assert utils.get_album_songs_from_gcs(ARTIST, BUCKET_NAME, "al1") is None
+    assert storage.ranges == []
@@ -0,0 +1,99 @@
+import random
+
+import pytest
+
+from ingestion.batch_grouping import group_batch
+from ingestion.group_songs import group_songs
+
+
+def make_song(artist_id, song_id, title, duration_ms, isrc=None, popularity=50):
+    return {
+        "origination_artist_id": artist_id,
+        "artists": ["artist"],
+        "spotify_artist_ids": [artist_id],
+        "spotify_song_id": song_id,
+        "song": title,
+        "duration_ms": duration_ms,
+        "album": "album",
+        "spotify_popularity": popularity,
+        "isrc": isrc,
+    }
+
+
+def batch_groups(songs):
+    """{artist id: {group key: [song ids]}} from group_batch, in the order it writes them"""
+    grouped = {}
+    df = group_batch(songs, {}).sort_values(["group_order", "row"], kind="mergesort")
+    for song in df.itertuples(index=False):
+        grouped.setdefault(song.origination_artist_id, {}).setdefault(song.group_key, []).append(
+            song.spotify_song_id
+        )
+    return grouped
+
+
+def artist_groups(songs):
+    """The same from group_songs, run per artist"""
+    grouped = {}
+    for artist_id in dict.fromkeys(song["origination_artist_id"] for song in songs):
+        artist_songs = [song for song in songs if song["origination_artist_id"] == artist_id]
+        grouped[artist_id] = {
+            key: [variant["spotify_song_id"] for variant in group["variants"]]
+            for key, group in group_songs({"artist": artist_id}, None, artist_songs).items()
+        }
+    return grouped
+
+
+def assert_same_groups(songs):
+    assert batch_groups(songs) == artist_groups(songs)
+
+
+def test_chained_durations_follow_the_lowest_variant_in_range():
+    songs = [
+        make_song("a", "s0", "Song", 0),
+        make_song("a", "s1", "Song", 30000),
+        make_song("a", "s2", "Song", 15000),
+    ]
+    assert batch_groups(songs) == {"a": {"song": ["s0", "s2"], "song_variant2": ["s1"]}}
+    assert_same_groups(songs)
+
+
+def test_long_chain_opens_variants_in_song_order():
+    songs = [make_song("a", f"s{i}", "Song", i * 15000) for i in (4, 0, 2, 1, 3, 6, 5)]
+    assert_same_groups(songs)
+
+
+def test_isrc_match_joins_the_first_song_of_the_recording():
+    songs = [
+        make_song("a", "s0", "Song", 200000, isrc="US1"),
+        make_song("a", "s1", "Song (Live)", 100000, isrc="US2"),
+        make_song("a", "s2", "Other Title", 500000, isrc="US1"),
+        make_song("a", "s3", "Song", 215000),
+        make_song("b", "s4", "Song", 200000, isrc="US1"),
+    ]
+    assert_same_groups(songs)
+
+
+def test_isrc_duplicates_stay_out_of_the_duration_index():
+    songs = [
+        make_song("a", "s0", "Song", 0, isrc="US1"),
+        make_song("a", "s1", "Song", 60000, isrc="US1"),
+        make_song("a", "s2", "Song", 45000),
+        make_song("a", "s3", "Song", 10000, isrc=""),
+    ]
+    assert_same_groups(songs)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_random_batches_match_group_songs(seed):
+    rng = random.Random(seed)
+    songs = [
+        make_song(
+            rng.choice("abc"),
+            f"s{i}",
+            rng.choice(["Song", "Song - Remastered", "Other", "Third (Live)"]),
+            rng.randrange(0, 120000, 5000),
+            isrc=rng.choice([None, "", "US1", "US2", "US3"]),
+        )
+        for i in range(rng.randrange(1, 40))
+    ]
+    assert_same_groups(songs)
@@ -0,0 +1,97 @@
+import gzip
+import json
+
+import pytest
+
+from ingestion.codec import (
+    ALBUM_IMAGES_KEY,
+    SONGS_KEY,
+    content_encoding,
+    decode_json,
+    encode_json,
+    is_songs_list,
+    pack_songs,
+)
+
+COMPRESSIONS = ["zstd", "gzip", "none"]
+
+
+def make_song(song_id, album_id, images=None):
+    return {
+        "spotify_song_id": song_id,
+        "spotify_album_id": album_id,
+        "song": f"Song {song_id}",
+        "images": [f"https://i.scdn.co/image/{album_id}"] if images is None else images,
+    }
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_round_trips_plain_json(compression):
+    data = {"artist": "Artist", "followers": 12, "genres": ["pop", "dance"], "nested": {"a": None}}
+    assert decode_json(encode_json(data, compression)) == data
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_round_trips_songs_list(compression):
+    songs = [make_song("s0", "al0"), make_song("s1", "al0"), make_song("s2", "al1")]
+    assert decode_json(encode_json(songs, compression)) == songs
+
+
+@pytest.mark.parametrize(
+    "compression, expected", [("zstd", "zstd"), ("gzip", "gzip"), ("none", None)]
+)
+def test_content_encoding_matches_compression(compression, expected):
+    assert content_encoding(encode_json({"a": 1}, compression)) == expected
+
+
+def test_gzip_output_is_deterministic():
+    assert encode_json({"a": 1}, "gzip") == encode_json({"a": 1}, "gzip")
+
+
+def test_unknown_compression_raises():
+    with pytest.raises(ValueError):
+        encode_json({"a": 1}, "brotli")
+
+
+def test_decodes_blobs_written_before_the_codec():
+    data = [{"spotify_album_id": "al0", "album": "Album"}]
+    legacy = json.dumps(data, indent=3).encode("utf-8")
+    assert decode_json(legacy) == data
+    assert decode_json(gzip.compress(legacy)) == data
+
+
+def test_pack_songs_keeps_album_images_once():
+    packed = pack_songs([make_song("s0", "al0"), make_song("s1", "al0")])
+    assert packed[ALBUM_IMAGES_KEY] == {"al0": ["https://i.scdn.co/image/al0"]}
+    assert all("images" not in song for song in packed[SONGS_KEY])
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_songs_with_their_own_images_keep_them(compression):
+    songs = [
+        make_song("s0", "al0"),
+        make_song("s1", "al0", images=["https://i.scdn.co/image/backfilled"]),
+        make_song("s2", "al0", images=[]),
+        make_song("s3", "al0"),
+    ]
+    assert decode_json(encode_json(songs, compression)) == songs
+
+
+def test_decoded_songs_do_not_share_image_lists():
+    decoded = decode_json(encode_json([make_song("s0", "al0"), make_song("s1", "al0")], "none"))
+    decoded[0]["images"].append("extra")
+    assert decoded[1]["images"] == ["https://i.scdn.co/image/al0"]
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        [],
+        [{"spotify_song_id": "s0", "spotify_album_id": "al0"}],
+        [{"spotify_song_id": "s0", "images": [], "spotify_album_id": None}],
+        [make_song("s0", "al0"), {"spotify_album_id": "al1"}],
+    ],
+)
+def test_lists_that_are_not_songs_are_not_packed(data):
+    assert not is_songs_list(data)
+    assert decode_json(encode_json(data, "none")) == data